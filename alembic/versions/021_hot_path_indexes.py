@@ -0,0 +1,38 @@
+"""Composite indexes for hot cabinet/chat queries (history, lists with pagination).
+
+Revision ID: 021
+Revises: 020
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "021"
+down_revision: Union[str, None] = "020"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # История диалога и превью: WHERE dialog_id = ? ORDER BY created_at
+    op.create_index("ix_message_dialog_created", "message", ["dialog_id", "created_at"], unique=False)
+    # Список диалогов тенанта: WHERE tenant_id = ? ORDER BY updated_at DESC
+    op.create_index("ix_dialog_tenant_updated", "dialog", ["tenant_id", "updated_at"], unique=False)
+    # Избранное: WHERE tenant_id = ? AND user_id = ? ORDER BY created_at DESC. Старый индекс (tenant_id, user_id) —
+    # префикс нового и ему не нужен: удаляем, чтобы запись не обновляла оба
+    op.create_index(
+        "ix_saved_item_tenant_user_created", "saved_item", ["tenant_id", "user_id", "created_at"], unique=False
+    )
+    op.drop_index("ix_saved_item_tenant_user", table_name="saved_item")
+    # Лиды: WHERE tenant_id = ? ORDER BY updated_at DESC
+    op.create_index("ix_lead_tenant_updated", "lead", ["tenant_id", "updated_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_lead_tenant_updated", table_name="lead")
+    op.create_index("ix_saved_item_tenant_user", "saved_item", ["tenant_id", "user_id"], unique=False)
+    op.drop_index("ix_saved_item_tenant_user_created", table_name="saved_item")
+    op.drop_index("ix_dialog_tenant_updated", table_name="dialog")
+    op.drop_index("ix_message_dialog_created", table_name="message")
@@ -1,14 +1,41 @@
 """Async SQLAlchemy engine and session."""
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Callable
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.config import settings
 from app.models import Base
 
+
+def _connect_args() -> dict:
+    """Кэш подготовленных выражений: повторяющиеся запросы кабинета и чата не проходят parse/plan заново.
+    JIT PostgreSQL отключён: запросы приложения короткие, компиляция JIT стоит дороже их выполнения."""
+    if not settings.database_url.startswith("postgresql+asyncpg"):
+        return {}
+    return {
+        "statement_cache_size": settings.db_statement_cache_size,
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        "server_settings": {"jit": "off"},
+    }
+
+
+def _pool_args() -> dict:
+    """Размер пула (AsyncAdaptedQueuePool по умолчанию для async-движка); SQLite в тестах — без пула."""
+    if settings.database_url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": True,
+    }
+
+
 engine = create_async_engine(
     settings.database_url,
     echo=False,
+    connect_args=_connect_args(),
+    **_pool_args(),
 )
 
 async_session_maker = async_sessionmaker(
@@ -32,6 +59,24 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
+def call_after_commit(db: AsyncSession, fn: Callable[..., None], *args) -> None:
+    """Вызвать fn(*args) после коммита текущей транзакции сессии (сброс кэшей после изменения строки).
+    Сброс до коммита не помогает: конкурентный запрос успевает снова закэшировать ещё не изменённую строку.
+    При откате вызова нет — в кэше и так прежнее значение."""
+    event.listen(db.sync_session, "after_commit", lambda _session: fn(*args), once=True)
+
+
 async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+
+async def warm_up_pool() -> None:
+    """Открыть pool_size соединений при старте, чтобы первые запросы не ждали подключения к БД."""
+    conns = []
+    try:
+        for _ in range(settings.db_pool_size):
+            conns.append(await engine.connect())
+    finally:
+        for conn in conns:
+            await conn.close()
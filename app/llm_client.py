@@ -1,11 +1,13 @@
 """HTTP client for DeepSeek LLM with streaming and tool calling."""
-import json
 from collections.abc import AsyncIterator
 
 import httpx
+import orjson
 
 from app.config import settings
 
+# Тело запроса и строки потока (по одной на токен) — через orjson: кодирование и разбор в C, тело сразу в bytes
+
 
 def _build_url() -> str:
     base = settings.deepseek_api_url.rstrip("/")
@@ -37,7 +39,7 @@ async def stream_chat(
     }
     full_content: list[str] = []
     async with httpx.AsyncClient(timeout=60.0) as client:
-        async with client.stream("POST", url, json=payload, headers=headers) as response:
+        async with client.stream("POST", url, content=orjson.dumps(payload), headers=headers) as response:
             response.raise_for_status()
             async for line in response.aiter_lines():
                 if not line or not line.startswith("data: "):
@@ -46,8 +48,8 @@ async def stream_chat(
                 if data == "[DONE]":
                     break
                 try:
-                    obj = json.loads(data)
-                except json.JSONDecodeError:
+                    obj = orjson.loads(data)
+                except orjson.JSONDecodeError:
                     continue
                 choice = obj.get("choices") or []
                 if not choice:
@@ -88,9 +90,9 @@ async def chat_once_with_tools(
         "tools": tools,
     }
     async with httpx.AsyncClient(timeout=60.0) as client:
-        r = await client.post(url, json=payload, headers=headers)
+        r = await client.post(url, content=orjson.dumps(payload), headers=headers)
         r.raise_for_status()
-        data = r.json()
+        data = orjson.loads(r.content)
     choice = (data.get("choices") or [{}])[0]
     msg = choice.get("message") or {}
     content = (msg.get("content") or "").strip()
@@ -102,8 +104,74 @@ async def chat_once_with_tools(
         name = fn.get("name") or ""
         args_str = fn.get("arguments") or "{}"
         try:
-            args = json.loads(args_str) if args_str else {}
-        except json.JSONDecodeError:
+            args = orjson.loads(args_str) if args_str else {}
+        except orjson.JSONDecodeError:
             args = {}
         tool_calls.append({"id": fid, "name": name, "arguments": args})
     return {"content": content, "tool_calls": tool_calls if tool_calls else None}
+
+
+async def stream_chat_with_tools(
+    system_prompt: str,
+    messages: list[dict],
+    tools: list[dict],
+) -> AsyncIterator[dict]:
+    """
+    Запрос к LLM с передачей tools и stream=True.
+    Отдаёт {"content": str} по мере генерации текста; при первом фрагменте вызова инструмента —
+    {"tool_calls_started": True} (текст дальше — уже не ответ пользователю); в конце, если модель вызвала
+    инструменты, — {"tool_calls": [{"id": str, "name": str, "arguments": dict}]} (тот же формат, что у chat_once_with_tools).
+    """
+    url = _build_url()
+    headers = {
+        "Authorization": f"Bearer {settings.deepseek_api_key}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": "deepseek-chat",
+        "messages": _build_messages(system_prompt, messages),
+        "tools": tools,
+        "stream": True,
+    }
+    # Вызовы инструментов приходят по частям: собираем по index (id и name — в первом фрагменте, arguments — кусками)
+    calls: dict[int, dict] = {}
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        async with client.stream("POST", url, content=orjson.dumps(payload), headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line or not line.startswith("data: "):
+                    continue
+                data = line[6:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    obj = orjson.loads(data)
+                except orjson.JSONDecodeError:
+                    continue
+                choice = obj.get("choices") or []
+                if not choice:
+                    continue
+                delta = choice[0].get("delta") or {}
+                content = delta.get("content")
+                if content and isinstance(content, str):
+                    yield {"content": content}
+                for tc in delta.get("tool_calls") or []:
+                    if not calls:
+                        yield {"tool_calls_started": True}
+                    call = calls.setdefault(tc.get("index", 0), {"id": "", "name": "", "arguments": ""})
+                    if tc.get("id"):
+                        call["id"] = tc["id"]
+                    fn = tc.get("function") or {}
+                    if fn.get("name"):
+                        call["name"] += fn["name"]
+                    if fn.get("arguments"):
+                        call["arguments"] += fn["arguments"]
+    if calls:
+        tool_calls = []
+        for _, call in sorted(calls.items()):
+            try:
+                args = orjson.loads(call["arguments"]) if call["arguments"] else {}
+            except orjson.JSONDecodeError:
+                args = {}
+            tool_calls.append({"id": call["id"], "name": call["name"], "arguments": args})
+        yield {"tool_calls": tool_calls}
@@ -14,15 +14,36 @@ if not _app_log.handlers:
     _h.setFormatter(logging.Formatter("%(levelname)s: %(name)s: %(message)s"))
     _app_log.addHandler(_h)
 _app_log.propagate = False
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import get_db, warm_up_pool
 from app.routers import auth, chat, cabinet
 from app.services.cabinet_service import get_tenant_by_slug
+from app.services.llm_exchange_logger import flush_exchange_logs
 
-app = FastAPI(title="CIP Backend", description="Chat + User Cabinet API")
+# orjson для всех JSON-ответов API (кабинет, чат, авторизация) — сериализация в C вместо stdlib json
+app = FastAPI(
+    title="CIP Backend",
+    description="Chat + User Cabinet API",
+    default_response_class=ORJSONResponse,
+)
+
+
+@app.on_event("startup")
+async def _warm_up_db_pool():
+    """Соединения с БД открываются заранее; недоступность БД при старте не мешает запуску приложения."""
+    try:
+        await warm_up_pool()
+    except Exception as e:
+        _app_log.warning("DB pool warm-up failed: %s", e)
+
+
+@app.on_event("shutdown")
+async def _flush_exchange_logs():
+    """Логи обменов с DeepSeek пишутся пачками в фоне — дописываем то, что не успело попасть в файлы."""
+    await flush_exchange_logs()
 
 
 @app.exception_handler(Exception)
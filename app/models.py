@@ -84,6 +84,7 @@ class Dialog(Base):
 
     __table_args__ = (
         Index("ix_dialog_tenant_user_updated", "tenant_id", "user_id", "updated_at"),
+        Index("ix_dialog_tenant_updated", "tenant_id", "updated_at"),
     )
 
 
@@ -125,6 +126,7 @@ class Message(Base):
 
     __table_args__ = (
         Index("ix_message_tenant_user", "tenant_id", "user_id"),
+        Index("ix_message_dialog_created", "dialog_id", "created_at"),
     )
 
 
@@ -143,7 +145,7 @@ class SavedItem(Base):
     tenant = relationship("Tenant", back_populates="saved_items")
 
     __table_args__ = (
-        Index("ix_saved_item_tenant_user", "tenant_id", "user_id"),
+        Index("ix_saved_item_tenant_user_created", "tenant_id", "user_id", "created_at"),
     )
 
 
@@ -223,6 +225,7 @@ class Lead(Base):
     __tablename__ = "lead"
     __table_args__ = (
         UniqueConstraint("tenant_id", "user_id", "dialog_id", name="uq_lead_tenant_user_dialog"),
+        Index("ix_lead_tenant_updated", "tenant_id", "updated_at"),
     )
 
     id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -1,15 +1,24 @@
 """Cabinet: только для зарегистрированных (JWT). Диалоги, чанки промпта, вставка на сайт, админ-чат, галерея, RAG, профиль."""
+import hashlib
 import json
 from uuid import UUID, uuid4
 
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, Request, UploadFile
 from fastapi.responses import JSONResponse, Response
+from pydantic import TypeAdapter
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import call_after_commit, get_db
 from app.config import settings as app_settings
-from app.services.auth_service import decode_jwt, get_tenant_user_by_id, get_tenant_user_by_primary_key
+from app.services.settings_limits import get_limits_from_settings
+from app.services.auth_service import (
+    decode_jwt_cached,
+    get_tenant_user_by_id,
+    get_tenant_user_by_primary_key,
+    get_tenant_user_with_tenant,
+)
 from app.services.test_chat_history import clear_tenant_test_history
 from app.services.chat_service import clear_tenant_prod_history
 from app.schemas import (
@@ -41,13 +50,15 @@ from app.services.auth_service import create_impersonation_ticket
 from app.services.cabinet_service import (
     archive_dialog,
     delete_dialog,
+    delete_saved_item,
     get_dialog_by_id,
     get_dialog_messages,
     get_dialog_messages_for_tenant,
     get_profile,
-    get_saved_by_id,
     get_tenant_by_id,
-    get_tenant_by_slug,
+    get_tenant_by_slug_cached,
+    get_tenant_cached,
+    invalidate_tenant_cache,
     is_user_admin_for_tenant,
     list_all_tenants,
     list_dialogs,
@@ -64,33 +75,30 @@ from app.services.cabinet_service import (
 )
 from app.services.mcp_client import fetch_tools_from_url
 from app.models import SavedItem
-from app.services.prompt_loader import load_prompt, load_admin_prompt
+from app.services.prompt_loader import bump_prompt_version, load_prompt, load_admin_prompt
 from app.services.admin_prompt_service import get_admin_system_prompt, set_admin_system_prompt
-from app.services.admin_chat_service import handle_admin_message
+from app.services.admin_chat_service import AdminHistoryItem, handle_admin_message, invalidate_admin_context_cache
 from app.services.admin_chat_logger import append_admin_chat_exchange
 
 router = APIRouter(prefix="/api/v1/tenants", tags=["cabinet"])
 
-# Значения лимитов по умолчанию (могут быть переопределены в tenant.settings)
-DEFAULT_CHAT_MAX_USER_MESSAGE_CHARS = 500
-DEFAULT_USER_PROMPT_MAX_CHARS = 10000
-DEFAULT_RAG_MAX_DOCUMENTS = 3
-DEFAULT_GALLERY_MAX_GROUPS = 3
-DEFAULT_GALLERY_MAX_IMAGES_PER_GROUP = 3
+# Списки ORM-объектов валидируются одним вызовом pydantic-core вместо model_validate на каждую строку
+_SAVED_LIST_ADAPTER = TypeAdapter(list[SavedItemResponse])
+_LEAD_LIST_ADAPTER = TypeAdapter(list[LeadResponse])
+_MESSAGE_LIST_ADAPTER = TypeAdapter(list[MessageInDialog])
 
 
-def _get_limits_from_settings(settings: dict | None) -> dict:
-    """Возвращает словарь лимитов с подстановкой значений по умолчанию."""
-    s = settings or {}
-    return {
-        "chat_max_user_message_chars": int(s.get("chat_max_user_message_chars") or DEFAULT_CHAT_MAX_USER_MESSAGE_CHARS),
-        "user_prompt_max_chars": int(s.get("user_prompt_max_chars") or DEFAULT_USER_PROMPT_MAX_CHARS),
-        "rag_max_documents": int(s.get("rag_max_documents") or DEFAULT_RAG_MAX_DOCUMENTS),
-        "gallery_max_groups": int(s.get("gallery_max_groups") or DEFAULT_GALLERY_MAX_GROUPS),
-        "gallery_max_images_per_group": int(
-            s.get("gallery_max_images_per_group") or DEFAULT_GALLERY_MAX_IMAGES_PER_GROUP
-        ),
-    }
+def _make_etag(*parts) -> str:
+    """Слабый ETag по значимым частям ответа."""
+    digest = hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def _not_modified(request: Request, etag: str) -> Response | None:
+    """304 без тела, если клиент прислал тот же ETag в If-None-Match."""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
 
 
 @router.get("/by-slug/{slug}")
@@ -98,11 +106,11 @@ async def get_tenant_by_slug_endpoint(
     slug: str,
     db: AsyncSession = Depends(get_db),
 ):
-    tenant = await get_tenant_by_slug(db, slug)
+    tenant = await get_tenant_by_slug_cached(db, slug)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     settings = tenant.settings or {}
-    limits = _get_limits_from_settings(settings)
+    limits = get_limits_from_settings(settings)
     return {
         "id": str(tenant.id),
         "slug": tenant.slug,
@@ -113,42 +121,48 @@ async def get_tenant_by_slug_endpoint(
     }
 
 
-def get_cabinet_user_id(
-    request: Request,
+def get_cabinet_jwt_payload(
+    tenant_id: UUID,
     authorization: str | None = Header(None),
-) -> str:
-    """Личный кабинет только для зарегистрированных. Требуется JWT."""
-    tenant_id = request.path_params.get("tenant_id")
+) -> dict:
+    """Проверка JWT без обращения к БД: запросы без токена или с чужим токеном отсекаются до открытия сессии."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Требуется авторизация. Войдите в личный кабинет.")
     token = authorization[7:].strip()
-    payload = decode_jwt(token)
+    payload = decode_jwt_cached(token)
     if not payload or str(payload.get("tenant_id")) != str(tenant_id):
         raise HTTPException(status_code=401, detail="Неверный или истёкший токен")
+    return payload
+
+
+def get_cabinet_user_id(payload: dict = Depends(get_cabinet_jwt_payload)) -> str:
+    """Личный кабинет только для зарегистрированных. Требуется JWT."""
     return str(payload["sub"])
 
 
+# Успешные проверки доступа (tenant_id, user_id): повторные запросы кабинета в пределах TTL не ходят в БД.
+# Отказы не кэшируются — подтверждение email или вход в тенант начинают работать сразу.
+# Кэш свой в каждом воркере: блокировка тенанта сбрасывает его (после коммита) только в воркере, где она
+# выполнена; в остальных заблокированный тенант сохраняет доступ не дольше _CABINET_ACCESS_TTL_SECONDS.
+_CABINET_ACCESS_TTL_SECONDS = 60
+_cabinet_access_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_CABINET_ACCESS_TTL_SECONDS)
+
+
 async def get_cabinet_user(
-    request: Request,
-    authorization: str | None = Header(None),
+    tenant_id: UUID,
+    payload: dict = Depends(get_cabinet_jwt_payload),
     db: AsyncSession = Depends(get_db),
 ) -> str:
     """Личный кабинет только для зарегистрированных. Возвращает user_id после проверки TenantUser."""
-    tenant_id_raw = request.path_params.get("tenant_id")
-    if not tenant_id_raw:
-        raise HTTPException(status_code=400, detail="tenant_id required")
-    tenant_id = tenant_id_raw if isinstance(tenant_id_raw, UUID) else UUID(str(tenant_id_raw))
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Требуется авторизация. Войдите в личный кабинет.")
-    token = authorization[7:].strip()
-    payload = decode_jwt(token)
-    if not payload or str(payload.get("tenant_id")) != str(tenant_id):
-        raise HTTPException(status_code=401, detail="Неверный или истёкший токен")
     user_id = str(payload["sub"])
-    tenant = await get_tenant_by_id(db, tenant_id)
+    access_key = (tenant_id, user_id)
+    if access_key in _cabinet_access_cache:
+        return user_id
+    # Пользователь и тенант одним запросом; отдельный SELECT тенанта — только если пользователь не из этого тенанта
+    user = await get_tenant_user_with_tenant(db, tenant_id, user_id)
+    tenant = user.tenant if user else await get_tenant_by_id(db, tenant_id)
     if tenant and (tenant.settings or {}).get("blocked"):
         raise HTTPException(status_code=403, detail="Аккаунт заблокирован")
-    user = await get_tenant_user_by_id(db, tenant_id, user_id)
     if not user:
         try:
             uid = UUID(user_id)
@@ -157,15 +171,22 @@ async def get_cabinet_user(
         home_user = await get_tenant_user_by_primary_key(db, uid)
         if not home_user or not home_user.email_confirmed_at:
             raise HTTPException(status_code=403, detail="Доступ только для зарегистрированных пользователей")
-        home_tenant = await get_tenant_by_id(db, home_user.tenant_id)
+        home_tenant = await get_tenant_cached(db, home_user.tenant_id)
         admin_slug = (app_settings.admin_tenant_slug or "").strip()
         if not admin_slug or not home_tenant or home_tenant.slug != admin_slug:
             raise HTTPException(status_code=403, detail="Доступ только для зарегистрированных пользователей")
     elif not user.email_confirmed_at:
         raise HTTPException(status_code=403, detail="Доступ только для зарегистрированных пользователей")
+    _cabinet_access_cache[access_key] = True
     return user_id
 
 
+def _invalidate_cabinet_access(tenant_id: UUID) -> None:
+    """Сбросить закэшированные допуски к кабинету тенанта (после блокировки/разблокировки)."""
+    for key in [k for k in _cabinet_access_cache if k[0] == tenant_id]:
+        _cabinet_access_cache.pop(key, None)
+
+
 # Dialogs (все диалоги тенанта — посетители iframe; админ видит все)
 @router.get("/{tenant_id:uuid}/me/tenant/dialogs", response_model=DialogListResponse)
 async def list_tenant_dialogs_endpoint(
@@ -181,7 +202,7 @@ async def list_tenant_dialogs_endpoint(
     include_archived: bool = Query(False, description="Показать архивные диалоги"),
 ):
     from datetime import datetime as dt
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     d_from = dt.strptime(date_from, "%Y-%m-%d").date() if date_from else None
@@ -217,7 +238,7 @@ async def get_tenant_dialog(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     dialog = await get_dialog_by_id(db, tenant_id, dialog_id)
@@ -229,7 +250,7 @@ async def get_tenant_dialog(
     viewed_at = await mark_dialog_viewed(db, tenant_id, cabinet_user_id=user_id, dialog_id=dialog_id)
     return DialogDetailResponse(
         id=dialog_id,
-        messages=[MessageInDialog(role=m.role, content=m.content, created_at=m.created_at) for m in messages],
+        messages=_MESSAGE_LIST_ADAPTER.validate_python(messages, from_attributes=True),
         viewed_at=viewed_at,
         archived=getattr(dialog, "archived", False),
     )
@@ -242,7 +263,7 @@ async def archive_tenant_dialog(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     ok = await archive_dialog(db, tenant_id, dialog_id)
@@ -259,7 +280,7 @@ async def delete_tenant_dialog(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     ok = await delete_dialog(db, tenant_id, dialog_id)
@@ -278,7 +299,7 @@ async def list_user_dialogs(
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     total, items = await list_dialogs(db, tenant_id, user_id, limit=limit, offset=offset)
@@ -303,7 +324,7 @@ async def get_user_dialog(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     messages = await get_dialog_messages(db, tenant_id, user_id, dialog_id)
@@ -311,7 +332,7 @@ async def get_user_dialog(
         raise HTTPException(status_code=404, detail="dialog not found")
     return DialogDetailResponse(
         id=dialog_id,
-        messages=[MessageInDialog(role=m.role, content=m.content, created_at=m.created_at) for m in messages],
+        messages=_MESSAGE_LIST_ADAPTER.validate_python(messages, from_attributes=True),
     )
 
 
@@ -324,11 +345,11 @@ async def list_user_saved(
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     _, items = await list_saved(db, tenant_id, user_id, limit=limit, offset=offset)
-    return [SavedItemResponse.model_validate(i) for i in items]
+    return _SAVED_LIST_ADAPTER.validate_python(items, from_attributes=True)
 
 
 @router.post("/{tenant_id:uuid}/me/saved", response_model=SavedItemResponse, status_code=201)
@@ -338,7 +359,7 @@ async def create_saved(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     item = SavedItem(
@@ -348,6 +369,7 @@ async def create_saved(
         reference_id=body.reference_id,
     )
     db.add(item)
+    # INSERT до ответа: ошибка ограничения вернётся клиенту, а не после уже собранного 201
     await db.flush()
     return SavedItemResponse.model_validate(item)
 
@@ -359,14 +381,11 @@ async def delete_saved(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    item = await get_saved_by_id(db, tenant_id, user_id, saved_id)
-    if not item:
+    if not await delete_saved_item(db, tenant_id, user_id, saved_id):
         raise HTTPException(status_code=404, detail="saved item not found")
-    await db.delete(item)
-    await db.flush()
 
 
 # Текущий пользователь: является ли админом (текущий тенант или «домашний» тенант = ADMIN_TENANT_SLUG)
@@ -376,7 +395,7 @@ async def get_me_is_admin(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     admin_slug = (app_settings.admin_tenant_slug or "").strip()
@@ -391,7 +410,7 @@ async def get_me_is_admin(
     home_user = await get_tenant_user_by_primary_key(db, uid)
     if not home_user:
         return {"is_admin": False}
-    home_tenant = await get_tenant_by_id(db, home_user.tenant_id)
+    home_tenant = await get_tenant_cached(db, home_user.tenant_id)
     return {"is_admin": bool(home_tenant and home_tenant.slug == admin_slug)}
 
 
@@ -399,6 +418,8 @@ async def get_me_is_admin(
 @router.get("/{tenant_id:uuid}/me/profile", response_model=ProfileResponse)
 async def get_user_profile(
     tenant_id: UUID,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
@@ -424,7 +445,7 @@ async def get_user_profile(
     settings = getattr(tenant, "settings", None) or {}
     chat_theme = settings.get("chat_theme")
     quick_reply_buttons = settings.get("quick_reply_buttons")
-    limits = _get_limits_from_settings(settings)
+    limits = get_limits_from_settings(settings)
     role = getattr(user, "role", None) or None
     display_name = profile.display_name if profile else None
     contact = profile.contact if profile else None
@@ -434,7 +455,7 @@ async def get_user_profile(
     telegram_webhook_url = f"{_base}/api/v1/tenants/by-slug/{_slug}/telegram/webhook" if _base and _slug else (f"{_base}/api/v1/tenants/{tenant_id}/telegram/webhook" if _base else None)
     telegram_bot_token_set = bool((settings.get("telegram_bot_token") or "").strip())
     if not profile:
-        return ProfileResponse(
+        result = ProfileResponse(
             user_id=user_id,
             role=role,
             display_name=display_name,
@@ -450,22 +471,30 @@ async def get_user_profile(
             telegram_webhook_url=telegram_webhook_url,
             telegram_bot_token_set=telegram_bot_token_set,
         )
-    return ProfileResponse(
-        user_id=profile.user_id,
-        role=role,
-        display_name=profile.display_name,
-        contact=profile.contact,
-        system_prompt=system_prompt,
-        chat_theme=chat_theme,
-        quick_reply_buttons=quick_reply_buttons,
-        chat_max_user_message_chars=limits["chat_max_user_message_chars"],
-        user_prompt_max_chars=limits["user_prompt_max_chars"],
-        rag_max_documents=limits["rag_max_documents"],
-        gallery_max_groups=limits["gallery_max_groups"],
-        gallery_max_images_per_group=limits["gallery_max_images_per_group"],
-        telegram_webhook_url=telegram_webhook_url,
-        telegram_bot_token_set=telegram_bot_token_set,
-    )
+    else:
+        result = ProfileResponse(
+            user_id=profile.user_id,
+            role=role,
+            display_name=profile.display_name,
+            contact=profile.contact,
+            system_prompt=system_prompt,
+            chat_theme=chat_theme,
+            quick_reply_buttons=quick_reply_buttons,
+            chat_max_user_message_chars=limits["chat_max_user_message_chars"],
+            user_prompt_max_chars=limits["user_prompt_max_chars"],
+            rag_max_documents=limits["rag_max_documents"],
+            gallery_max_groups=limits["gallery_max_groups"],
+            gallery_max_images_per_group=limits["gallery_max_images_per_group"],
+            telegram_webhook_url=telegram_webhook_url,
+            telegram_bot_token_set=telegram_bot_token_set,
+        )
+    # Профиль зависит и от настроек тенанта, поэтому ETag — по содержимому ответа, а не по profile.updated_at
+    etag = _make_etag(result.model_dump_json())
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = etag
+    return result
 
 
 @router.patch("/{tenant_id:uuid}/me/profile", response_model=ProfileResponse)
@@ -495,12 +524,15 @@ async def update_user_profile(
             settings["telegram_bot_token"] = (body.telegram_bot_token or "").strip() or None
         tenant.settings = settings
         flag_modified(tenant, "settings")
+    if body.system_prompt is not None:
+        bump_prompt_version(tenant)
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     settings = tenant.settings or {}
     _base = (app_settings.public_api_base_url or app_settings.frontend_base_url or "").strip().rstrip("/")
     _slug = (getattr(tenant, "slug", None) or "").strip()
     telegram_webhook_url = f"{_base}/api/v1/tenants/by-slug/{_slug}/telegram/webhook" if _base and _slug else (f"{_base}/api/v1/tenants/{tenant_id}/telegram/webhook" if _base else None)
-    limits = _get_limits_from_settings(settings)
+    limits = get_limits_from_settings(settings)
     telegram_bot_token_set = bool((settings.get("telegram_bot_token") or "").strip())
     return ProfileResponse(
         user_id=profile.user_id,
@@ -562,7 +594,7 @@ async def patch_user_prompt(
         raise HTTPException(status_code=404, detail="tenant not found")
     if body.system_prompt is not None:
         text = (body.system_prompt or "").strip()
-        limits = _get_limits_from_settings(tenant.settings or {})
+        limits = get_limits_from_settings(tenant.settings or {})
         max_len = limits["user_prompt_max_chars"]
         if len(text) > max_len:
             raise HTTPException(
@@ -572,8 +604,10 @@ async def patch_user_prompt(
         settings = dict(tenant.settings or {})
         settings["test_system_prompt"] = text or None
         tenant.settings = settings
+        bump_prompt_version(tenant)
         flag_modified(tenant, "settings")
-        clear_tenant_test_history(tenant_id)
+        await clear_tenant_test_history(tenant_id)
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     return _build_user_prompt_response(tenant)
 
@@ -630,8 +664,10 @@ async def patch_user_prompt_prod(
             settings["prod_system_prompt_prev"] = prev
         tenant.system_prompt = text or None
         tenant.settings = settings
+        bump_prompt_version(tenant)
         flag_modified(tenant, "settings")
         await clear_tenant_prod_history(db, tenant_id)
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     return _build_user_prompt_response(tenant)
 
@@ -654,8 +690,10 @@ async def copy_test_prompt_to_prod(
         settings["prod_system_prompt_prev"] = prev
     tenant.system_prompt = test
     tenant.settings = settings
+    bump_prompt_version(tenant)
     flag_modified(tenant, "settings")
     await clear_tenant_prod_history(db, tenant_id)
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     return _build_user_prompt_response(tenant)
 
@@ -678,8 +716,10 @@ async def rollback_prod_prompt(
     tenant.system_prompt = prev
     settings["prod_system_prompt_prev"] = current
     tenant.settings = settings
+    bump_prompt_version(tenant)
     flag_modified(tenant, "settings")
     await clear_tenant_prod_history(db, tenant_id)
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     return _build_user_prompt_response(tenant)
 
@@ -691,7 +731,7 @@ async def get_admin_prompt(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -706,7 +746,7 @@ async def patch_admin_prompt(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -722,7 +762,7 @@ async def get_admin_prompt_default(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -745,7 +785,7 @@ async def list_user_leads(
     date_to: str | None = Query(None, description="YYYY-MM-DD"),
 ):
     from datetime import datetime as dt
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     d_from = dt.strptime(date_from, "%Y-%m-%d").date() if date_from else None
@@ -753,23 +793,31 @@ async def list_user_leads(
     _, items = await list_leads(
         db, tenant_id, limit=limit, offset=offset, date_from=d_from, date_to=d_to
     )
-    return [LeadResponse.model_validate(l) for l in items]
+    return _LEAD_LIST_ADAPTER.validate_python(items, from_attributes=True)
 
 
 # Embed: код iframe для вставки чата на сайт (URL из FRONTEND_BASE_URL, в пути — slug тенанта)
 @router.get("/{tenant_id:uuid}/me/embed", response_model=EmbedCodeResponse)
 async def get_embed_code(
     tenant_id: UUID,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
     from app.config import settings
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     base_url = (settings.frontend_base_url or "").strip().rstrip("/")
     if not base_url:
         base_url = "https://YOUR_DOMAIN"
+    # Код вставки полностью определяется тенантом и адресом фронтенда
+    etag = _make_etag(tenant.id, tenant.slug, base_url)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+    response.headers["ETag"] = etag
     chat_url = f"{base_url}/{tenant.slug}/chat/embed"
     iframe_code = (
         f'<iframe src="{chat_url}" '
@@ -850,10 +898,10 @@ async def gallery_create_group(
 ):
     body["tenant_id"] = str(tenant_id)
     # Проверка лимита количества галерей
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
+    limits = get_limits_from_settings(getattr(tenant, "settings", None) or {})
     max_groups = limits["gallery_max_groups"]
     cur_status, cur_text = await gallery_request("GET", f"/api/v1/groups?tenant_id={tenant_id}", tenant_id)
     if cur_status == 200 and cur_text:
@@ -870,6 +918,7 @@ async def gallery_create_group(
     status, text = await gallery_request("POST", "/api/v1/groups", tenant_id, json_body=body)
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return JSONResponse(content=json.loads(text), status_code=201)
 
 
@@ -883,6 +932,7 @@ async def gallery_update_group(
     status, text = await gallery_request("PATCH", f"/api/v1/groups/{group_id}", tenant_id, json_body=body)
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return JSONResponse(content=json.loads(text))
 
 
@@ -895,6 +945,7 @@ async def gallery_delete_group(
     status, text = await gallery_request("DELETE", f"/api/v1/groups/{group_id}", tenant_id)
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return Response(status_code=204)
 
 
@@ -907,13 +958,13 @@ async def gallery_add_image(
     user_id: str = Depends(get_cabinet_user),
     db: AsyncSession = Depends(get_db),
 ):
-    content = await file.read()
-    files = {"file": (file.filename or "image", content, file.content_type or "application/octet-stream")}
+    # Файл передаём как file-like: httpx читает его частями, без копии всего содержимого в bytes
+    files = {"file": (file.filename or "image", file.file, file.content_type or "application/octet-stream")}
     # Проверка лимита количества изображений в галерее
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
+    limits = get_limits_from_settings(getattr(tenant, "settings", None) or {})
     max_images = limits["gallery_max_images_per_group"]
     cur_status, cur_text = await gallery_request("GET", f"/api/v1/groups/{group_id}", tenant_id)
     if cur_status == 200 and cur_text:
@@ -938,11 +989,17 @@ async def gallery_add_image(
     return JSONResponse(content=data, status_code=201)
 
 
+# Изображение по тому же URL может быть удалено или заменено: браузер держит его недолго,
+# дальше перепроверяет по ETag (304 без тела, если файл не изменился)
+_GALLERY_IMAGE_CACHE_CONTROL = "public, max-age=300"
+
+
 @router.get("/{tenant_id:uuid}/me/gallery/groups/{group_id:uuid}/images/{image_id:uuid}/file")
 async def gallery_serve_image(
     tenant_id: UUID,
     group_id: UUID,
     image_id: UUID,
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
 ):
     """Отдаёт бинарный файл изображения из БД галереи. Без авторизации — URL с uuid непредсказуем."""
     status, content, content_type = await gallery_get_file(
@@ -950,7 +1007,15 @@ async def gallery_serve_image(
     )
     if status != 200:
         return Response(status_code=status)
-    return Response(content=content, media_type=content_type or "application/octet-stream")
+    etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+    headers = {"Cache-Control": _GALLERY_IMAGE_CACHE_CONTROL, "ETag": etag}
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=content,
+        media_type=content_type or "application/octet-stream",
+        headers=headers,
+    )
 
 
 @router.delete("/{tenant_id:uuid}/me/gallery/groups/{group_id:uuid}/images/{image_id:uuid}")
@@ -996,8 +1061,7 @@ async def rag_preview_document(
     user_id: str = Depends(get_cabinet_user),
 ):
     """Преобразует PDF в markdown, возвращает текст без сохранения (для предпросмотра)."""
-    content = await file.read()
-    files = {"file": (file.filename or "doc.pdf", content, file.content_type or "application/pdf")}
+    files = {"file": (file.filename or "doc.pdf", file.file, file.content_type or "application/pdf")}
     status, text = await rag_request("POST", "/api/v1/documents/preview", files=files)
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
@@ -1013,10 +1077,10 @@ async def rag_save_document(
 ):
     """Сохраняет документ в RAG из markdown (после предпросмотра)."""
     # Проверка лимита количества документов RAG
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
+    limits = get_limits_from_settings(getattr(tenant, "settings", None) or {})
     max_docs = limits["rag_max_documents"]
     cur_status, cur_text = await rag_request(
         "GET", "/api/v1/documents", params={"tenant_id": str(tenant_id)}
@@ -1040,6 +1104,7 @@ async def rag_save_document(
     )
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return JSONResponse(content=json.loads(text), status_code=201)
 
 
@@ -1053,10 +1118,10 @@ async def rag_upload_document(
 ):
     doc_name = (name or (file.filename or "document").replace(".pdf", "")).strip() or "document"
     # Проверка лимита количества документов RAG
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
+    limits = get_limits_from_settings(getattr(tenant, "settings", None) or {})
     max_docs = limits["rag_max_documents"]
     cur_status, cur_text = await rag_request(
         "GET", "/api/v1/documents", params={"tenant_id": str(tenant_id)}
@@ -1073,11 +1138,11 @@ async def rag_upload_document(
         except json.JSONDecodeError:
             pass
     params = {"tenant_id": str(tenant_id), "name": doc_name}
-    content = await file.read()
-    files = {"file": (file.filename or "doc.pdf", content, file.content_type or "application/pdf")}
+    files = {"file": (file.filename or "doc.pdf", file.file, file.content_type or "application/pdf")}
     status, text = await rag_request("POST", "/api/v1/documents", params=params, files=files)
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return JSONResponse(content=json.loads(text), status_code=201)
 
 
@@ -1090,6 +1155,7 @@ async def rag_delete_document(
     status, text = await rag_request("DELETE", f"/api/v1/documents/{document_id}")
     if status >= 400:
         return JSONResponse(content={"detail": text}, status_code=status)
+    invalidate_admin_context_cache(tenant_id)
     return Response(status_code=204)
 
 
@@ -1101,7 +1167,7 @@ async def mcp_servers_list(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1139,7 +1205,7 @@ async def mcp_server_create(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1165,7 +1231,7 @@ async def mcp_server_update(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1196,7 +1262,7 @@ async def mcp_server_delete(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1214,10 +1280,10 @@ async def get_limits(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    limits = _get_limits_from_settings(tenant.settings or {})
+    limits = get_limits_from_settings(tenant.settings or {})
     return LimitsResponse(
         chat_max_user_message_chars=limits["chat_max_user_message_chars"],
         user_prompt_max_chars=limits["user_prompt_max_chars"],
@@ -1239,7 +1305,7 @@ async def update_limits(
         raise HTTPException(status_code=404, detail="tenant not found")
     settings = dict(tenant.settings or {})
     # Лимит 1 (chat_max_user_message_chars) редактируется только через код, здесь не трогаем.
-    current_limits = _get_limits_from_settings(settings)
+    current_limits = get_limits_from_settings(settings)
     if body.user_prompt_max_chars is not None:
         settings["user_prompt_max_chars"] = body.user_prompt_max_chars
         current_limits["user_prompt_max_chars"] = body.user_prompt_max_chars
@@ -1254,6 +1320,7 @@ async def update_limits(
         current_limits["gallery_max_images_per_group"] = body.gallery_max_images_per_group
     tenant.settings = settings
     flag_modified(tenant, "settings")
+    call_after_commit(db, invalidate_tenant_cache, tenant_id)
     await db.flush()
     return LimitsResponse(
         chat_max_user_message_chars=current_limits["chat_max_user_message_chars"],
@@ -1273,7 +1340,7 @@ async def admin_impersonate_tenant(
     user_id: str = Depends(get_cabinet_user),
 ):
     """Возвращает билет для открытия кабинета выбранного тенанта. Администратор откроет кабинет от имени первого пользователя тенанта (сессия 30 мин)."""
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1297,7 +1364,7 @@ async def admin_block_tenant(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1307,6 +1374,8 @@ async def admin_block_tenant(
     settings = dict(target.settings or {})
     settings["blocked"] = body.blocked
     target.settings = settings
+    call_after_commit(db, invalidate_tenant_cache, target.id)
+    call_after_commit(db, _invalidate_cabinet_access, target.id)
     await db.flush()
     return {"blocked": body.blocked}
 
@@ -1328,7 +1397,7 @@ async def _require_admin_tenant(tenant_slug: str, db: AsyncSession, user_id: str
     home_user = await get_tenant_user_by_primary_key(db, uid)
     if not home_user:
         raise HTTPException(status_code=403, detail="Доступ только для администратора.")
-    home_tenant = await get_tenant_by_id(db, home_user.tenant_id)
+    home_tenant = await get_tenant_cached(db, home_user.tenant_id)
     if home_tenant and home_tenant.slug == admin_slug:
         return
     raise HTTPException(
@@ -1347,7 +1416,7 @@ async def admin_list_tenants_with_limits(
     offset: int = Query(0, ge=0),
     search: str | None = Query(None, description="Поиск по slug или названию тенанта"),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1355,7 +1424,7 @@ async def admin_list_tenants_with_limits(
     out = []
     for t in tenants:
         settings = t.settings or {}
-        limits = _get_limits_from_settings(settings)
+        limits = get_limits_from_settings(settings)
         out.append(
             TenantWithLimitsItem(
                 id=t.id,
@@ -1384,7 +1453,7 @@ async def admin_update_tenant_limits(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     await _require_admin_tenant(tenant.slug, db, user_id)
@@ -1392,7 +1461,7 @@ async def admin_update_tenant_limits(
     if not target:
         raise HTTPException(status_code=404, detail="tenant not found")
     settings = dict(target.settings or {})
-    current_limits = _get_limits_from_settings(settings)
+    current_limits = get_limits_from_settings(settings)
     if body.user_prompt_max_chars is not None:
         settings["user_prompt_max_chars"] = body.user_prompt_max_chars
         current_limits["user_prompt_max_chars"] = body.user_prompt_max_chars
@@ -1406,6 +1475,7 @@ async def admin_update_tenant_limits(
         settings["gallery_max_images_per_group"] = body.gallery_max_images_per_group
         current_limits["gallery_max_images_per_group"] = body.gallery_max_images_per_group
     target.settings = settings
+    call_after_commit(db, invalidate_tenant_cache, target.id)
     await db.flush()
     return LimitsResponse(
         chat_max_user_message_chars=current_limits["chat_max_user_message_chars"],
@@ -1424,11 +1494,11 @@ async def admin_chat(
     db: AsyncSession = Depends(get_db),
     user_id: str = Depends(get_cabinet_user),
 ):
-    tenant = await get_tenant_by_id(db, tenant_id)
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
     session_id = body.session_id or str(uuid4())
-    history = [{"role": m.role, "content": m.content} for m in body.history]
+    history = (AdminHistoryItem(m.role, m.content) for m in body.history)
     result = await handle_admin_message(
         db, tenant_id, user_id, body.message.strip(), history=history
     )
@@ -1454,10 +1524,9 @@ async def admin_chat(
         request_context,
         "\n\n[messages]\n",
     ]
+    # handle_admin_message отдаёт уже нормализованные сообщения (роль проверена, content без пробелов по краям)
     for m in request_messages:
-        role = m.get("role", "")
-        content = (m.get("content") or "").strip()
-        request_to_llm_parts.append(f"{role}:\n{content}\n")
+        request_to_llm_parts.append(f"{m['role']}:\n{m['content']}\n")
     request_to_llm = "".join(request_to_llm_parts)
     raw_reply = result.get("raw_reply") or ""
     is_admin = await is_user_admin_for_tenant(db, tenant_id, user_id)
@@ -1,29 +1,183 @@
 """Chat: POST message -> SSE stream. Системный промпт из чанков. Галерея и RAG через MCP (tools)."""
-import json
+import asyncio
 import logging
+from collections.abc import AsyncIterator
+from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
 from uuid import UUID
 
 import httpx
+import orjson
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 _log = logging.getLogger(__name__)
 
-from app.database import get_db
+from app.database import async_session_maker, get_db
 from app.schemas import ChatMessageResponse, ChatRequest
-from app.services.chat_service import get_or_create_dialog, get_dialog_messages_for_llm, save_message
-from app.services.leads import save_lead_if_contact
-from app.services.prompt_loader import get_welcome_for_tenant, load_prompt_for_tenant, load_test_prompt_for_tenant
-from app.services.cabinet_service import get_tenant_by_id, get_tenant_by_slug, is_user_admin_for_tenant
-from app.services.user_chat_mcp_service import run_user_chat_with_mcp_tools
-from app.services.test_chat_history import get_test_history, save_test_history
-from app.services.auth_service import decode_jwt
+from app.services.chat_service import (
+    get_dialog_tail_for_llm,
+    get_or_create_dialog,
+    save_messages_bulk,
+    save_messages_bulk_own_session,
+)
+from app.services.settings_limits import get_limits_from_settings
+from app.services.leads import has_contact, save_lead_if_contact_own_session
+from app.services.prompt_loader import (
+    get_prompt_version,
+    get_welcome_for_tenant,
+    load_prompt_for_tenant,
+    load_test_prompt_for_tenant,
+)
+from app.services.cabinet_service import TenantInfo, get_tenant_by_slug_cached, get_tenant_cached, is_user_admin_for_tenant
+from app.services.response_cache import (
+    finish_inflight_response,
+    get_cached_response,
+    join_inflight_response,
+    get_response_cache_ttl,
+    make_response_cache_key,
+    set_cached_response,
+)
+from app.services.user_chat_mcp_service import (
+    CONTEXT_MESSAGE_LIMIT,
+    TOOL_LIMIT_REPLY,
+    context_window_start,
+    run_user_chat_with_mcp_tools_stream,
+)
+from app.services.test_chat_history import append_test_history, get_test_history
+from app.services.auth_service import decode_jwt_cached
 
 router = APIRouter(prefix="/api/v1/tenants", tags=["chat"])
 
-# Размер чанка при «стриме» уже обработанного ответа (для плавного отображения)
-_STREAM_CHUNK = 80
+# Кадры SSE собираются из готовых байтовых частей: меняется только JSON-строка значения
+_SSE_DONE = b"data: [DONE]\n\n"
+_SSE_CONTENT_PREFIX = b'data: {"content":'
+_SSE_ERROR_PREFIX = b'data: {"error":'
+_SSE_FRAME_END = b"}\n\n"
+# Комментарий SSE (клиент его игнорирует): не даёт прокси закрыть соединение, пока модель или инструменты молчат
+_SSE_PING = b": ping\n\n"
+# Первый байт потока — до запросов к БД и вызова модели: прокси сразу начинает отдавать ответ, клиент видит, что поток открыт
+_SSE_OPEN = b": open\n\n"
+_SSE_PING_INTERVAL_SECONDS = 15.0
+# no-transform запрещает промежуточным прокси сжимать поток (gzip копит кадры в буфер перед отправкой),
+# X-Accel-Buffering: no — то же для буфера nginx
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+# Фоновые задачи (запись ответа бота после закрытия потока): держим ссылки, чтобы их не собрал GC
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _sse_content(text: str) -> bytes:
+    """Кадр SSE с текстом ответа. orjson сразу отдаёт UTF-8, StreamingResponse не перекодирует строку."""
+    return _SSE_CONTENT_PREFIX + orjson.dumps(text) + _SSE_FRAME_END
+
+
+@lru_cache(maxsize=64)
+def _sse_error(message: str) -> bytes:
+    """Кадр ошибки SSE. Сообщений немного (detail из HTTPException), поэтому готовые кадры кэшируются."""
+    return _SSE_ERROR_PREFIX + orjson.dumps(message) + _SSE_FRAME_END
+
+
+async def _with_keepalive(frames: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Пробрасывает кадры SSE; если следующего кадра нет дольше _SSE_PING_INTERVAL_SECONDS — отправляет ping."""
+    it = frames.__aiter__()
+    next_frame = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_frame}, timeout=_SSE_PING_INTERVAL_SECONDS)
+            if not done:
+                yield _SSE_PING
+                continue
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+            next_frame = asyncio.ensure_future(it.__anext__())
+    finally:
+        # Клиент ушёл (или поток закончился): незавершённое чтение отменяется, внутренний генератор закрывается —
+        # его finally (сохранение части ответа, закрытие соединения с моделью) выполняется сразу, а не при сборке мусора
+        if not next_frame.done():
+            next_frame.cancel()
+            await asyncio.wait({next_frame})
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+@lru_cache(maxsize=64)
+def _too_long_detail(max_len: int) -> str:
+    """Текст ошибки «слишком длинное» для лимита (лимитов немного — строка собирается один раз)."""
+    return f"Сообщение слишком длинное. Максимум {max_len} символов."
+
+
+def _message_too_long(tenant: TenantInfo, text: str) -> str | None:
+    """Текст ошибки, если сообщение длиннее лимита тенанта (по умолчанию 500 символов); иначе None."""
+    max_len = get_limits_from_settings(tenant.settings)["chat_max_user_message_chars"]
+    if len(text) > max_len:
+        return _too_long_detail(max_len)
+    return None
+
+
+async def _save_messages_bg(tenant_id: UUID, user_id: str, dialog_id: UUID, rows: list[dict]) -> None:
+    try:
+        await save_messages_bulk_own_session(tenant_id, user_id, dialog_id, rows)
+    except Exception:
+        _log.exception("background save of chat messages failed: dialog %s", dialog_id)
+
+
+async def _save_lead_bg(tenant_id: UUID, user_id: str, dialog_id: UUID, message_text: str) -> None:
+    try:
+        await save_lead_if_contact_own_session(tenant_id, user_id, dialog_id, message_text)
+    except Exception:
+        _log.exception("background save of lead failed: dialog %s", dialog_id)
+
+
+def _spawn_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _prompt_alongside(prompt_coro, db_coro) -> tuple:
+    """Загрузка промпта (своя сессия) параллельно с запросом в сессии запроса.
+    TaskGroup при ошибке одной задачи отменяет и дожидается второй: ошибка (например, HTTPException 400
+    без файла промпта) выходит наружу, только когда сессия запроса уже свободна, — откат или закрытие
+    сессии в get_db не выполняются одновременно с её запросом."""
+    try:
+        async with asyncio.TaskGroup() as tg:
+            prompt_task = tg.create_task(prompt_coro)
+            db_task = tg.create_task(db_coro)
+    except BaseExceptionGroup as eg:
+        # Наружу — исходное исключение (HTTPException обрабатывается FastAPI), а не группа
+        raise eg.exceptions[0]
+    return prompt_task.result(), db_task.result()
+
+
+async def _load_chat_prompt(db: AsyncSession, tenant: TenantInfo, is_test: bool) -> str:
+    """Системный промпт тестового или боевого чата; отсутствие файла промпта — 400.
+    Версия промпта берётся из уже загруженного тенанта — кэш промпта проверяется без запроса к БД."""
+    version = get_prompt_version(tenant.settings)
+    try:
+        if is_test:
+            return await load_test_prompt_for_tenant(db, tenant.id, version)
+        return await load_prompt_for_tenant(db, tenant.id, version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _load_chat_prompt_own_session(tenant: TenantInfo, is_test: bool) -> str:
+    """_load_chat_prompt в отдельной сессии — чтобы выполнять параллельно с запросами в сессии запроса.
+    При попадании в кэш промпта соединение из пула не берётся вовсе."""
+    async with async_session_maker() as s:
+        return await _load_chat_prompt(s, tenant, is_test)
 
 
 async def _get_chat_reply(
@@ -35,62 +189,162 @@ async def _get_chat_reply(
     is_test: bool = False,
     from_telegram: bool = False,
     is_admin: bool = False,
+    prompt: str | None = None,
+    tenant: TenantInfo | None = None,
 ) -> str:
-    """Получить полный ответ бота (сохраняет сообщения в БД). Для SSE и для JSON-ответа."""
-    tenant = await get_tenant_by_id(db, tenant_id)
+    """Получить полный ответ бота (сохраняет сообщения в БД). Для JSON-ответа и Telegram."""
+    parts = []
+    async for chunk in _chat_reply_stream(
+        tenant_id,
+        user_id,
+        dialog_id,
+        message_text,
+        db,
+        is_test=is_test,
+        from_telegram=from_telegram,
+        is_admin=is_admin,
+        prompt=prompt,
+        tenant=tenant,
+    ):
+        parts.append(chunk)
+    return "".join(parts).strip()
+
+
+async def _chat_reply_stream(
+    tenant_id: UUID,
+    user_id: str,
+    dialog_id: UUID | None,
+    message_text: str,
+    db: AsyncSession,
+    is_test: bool = False,
+    from_telegram: bool = False,
+    is_admin: bool = False,
+    prompt: str | None = None,
+    tenant: TenantInfo | None = None,
+) -> AsyncIterator[str]:
+    """Ответ бота по мере генерации модели; после окончания ответ сохраняется в БД (или в тестовую историю).
+    prompt и tenant — уже загруженные в обработчике промпт и тенант (если None, загружаются здесь)."""
+    if tenant is None:
+        tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="tenant not found")
-    try:
-        if is_test:
-            prompt = await load_test_prompt_for_tenant(db, tenant_id)
-        else:
-            prompt = await load_prompt_for_tenant(db, tenant_id)
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=400, detail=str(e))
     if is_test:
-        previous_history = get_test_history(tenant_id, user_id)
-        history = previous_history + [{"role": "user", "content": message_text}]
+        if prompt is None:
+            prompt = await _load_chat_prompt(db, tenant, is_test)
+        # get_test_history отдаёт историю только для чтения — новый список собирается один раз
+        history = [*await get_test_history(tenant_id, user_id), {"role": "user", "content": message_text}]
         dialog = None
         session_id = f"test_{user_id}"
     else:
-        dialog = await get_or_create_dialog(db, tenant_id, user_id, dialog_id)
-        history = await get_dialog_messages_for_llm(db, dialog.id, tenant_id)
+        if prompt is None:
+            # Промпт (в своей сессии; из кэша — без обращения к БД) и диалог (сессия запроса) независимы
+            prompt, dialog = await _prompt_alongside(
+                _load_chat_prompt_own_session(tenant, is_test),
+                get_or_create_dialog(db, tenant_id, user_id, dialog_id),
+            )
+        else:
+            dialog = await get_or_create_dialog(db, tenant_id, user_id, dialog_id)
+        if has_contact(message_text):
+            # Ответ от лида не зависит: он пишется в фоне в своей сессии; коммит делает новый диалог видимым для неё (FK)
+            await db.commit()
+            _spawn_background(_save_lead_bg(tenant_id, user_id, dialog.id, message_text))
+        tail, total = await get_dialog_tail_for_llm(db, dialog.id, tenant_id, CONTEXT_MESSAGE_LIMIT)
+        # Из БД читается только хвост диалога; окно выравнивается по полной длине истории с новым сообщением,
+        # как это сделал бы _context_window — префикс запроса к модели остаётся прежним
+        skip = context_window_start(total + 1) - (total - len(tail))
+        history = tail[max(skip, 0):]
         history.append({"role": "user", "content": message_text})
-        await save_message(db, tenant_id, user_id, dialog.id, "user", message_text)
-        await save_lead_if_contact(db, tenant_id, user_id, dialog.id, message_text)
+        # Сообщение пользователя пишется до вызова модели и фиксируется вместе с диалогом (коммит перед
+        # вызовом модели): обрыв потока клиентом не теряет ход пользователя
+        user_row = {"role": "user", "content": message_text, "created_at": datetime.utcnow()}
+        await save_messages_bulk(db, tenant_id, user_id, dialog.id, [user_row])
         session_id = str(dialog.id) if dialog else user_id
+    # Кэш ответов (если включён у тенанта): только первое сообщение боевого диалога, не для администратора
+    cache_ttl = 0 if is_test or is_admin or len(history) != 1 else get_response_cache_ttl(tenant.settings)
+    cache_key = make_response_cache_key(tenant_id, prompt, message_text, from_telegram) if cache_ttl else None
+    cached = await get_cached_response(cache_key) if cache_key else None
+    leader = False
+    if cache_key and cached is None:
+        waiter = join_inflight_response(cache_key)
+        if waiter is None:
+            leader = True
+        else:
+            # Такой же вопрос уже у модели: ждём его ответ, не держа транзакцию (и соединение) открытыми
+            await db.commit()
+            cached = await asyncio.shield(waiter)
+    parts = []
+    completed = False
+    failed = False
     try:
-        final_text = await run_user_chat_with_mcp_tools(
-            tenant_id,
-            prompt,
-            history,
-            db,
-            from_telegram=from_telegram,
-            is_admin=is_admin,
-            is_test=is_test,
-            session_id=session_id,
-        )
+        if cached is not None:
+            # Модель не вызывается; диалог фиксируем, как это сделал бы вызов модели (ответ пишется в фоне)
+            await db.commit()
+            parts.append(cached)
+            yield cached
+        else:
+            async for chunk in run_user_chat_with_mcp_tools_stream(
+                tenant_id,
+                prompt,
+                history,
+                db,
+                from_telegram=from_telegram,
+                is_admin=is_admin,
+                is_test=is_test,
+                session_id=session_id,
+            ):
+                parts.append(chunk)
+                yield chunk
+        completed = True
     except Exception:
+        failed = True
         if not is_test and dialog:
-            await save_message(
+            await save_messages_bulk(
                 db,
                 tenant_id,
                 user_id,
                 dialog.id,
-                "assistant",
-                "Ошибка при обращении к модели или инструментам.",
+                [
+                    {
+                        "role": "assistant",
+                        "content": "Ошибка при обращении к модели или инструментам.",
+                        "created_at": datetime.utcnow(),
+                    },
+                ],
             )
         raise
+    finally:
+        if leader:
+            finish_inflight_response(cache_key, "".join(parts).strip() if completed else None)
+        partial_text = "".join(parts).strip()
+        if not completed and not failed and not is_test and dialog and partial_text:
+            # Клиент закрыл поток посреди ответа (CancelledError / GeneratorExit): уже отданная часть ответа
+            # сохраняется в фоне — ждать в генераторе, который закрывают, нельзя. Раз фрагменты ответа были,
+            # диалог и сообщение пользователя уже закоммичены
+            _spawn_background(
+                _save_messages_bg(
+                    tenant_id,
+                    user_id,
+                    dialog.id,
+                    [{"role": "assistant", "content": partial_text, "created_at": datetime.utcnow()}],
+                )
+            )
+    final_text = partial_text
+    if cache_key and cached is None and final_text and final_text != TOOL_LIMIT_REPLY:
+        await set_cached_response(cache_key, final_text, cache_ttl)
     if is_test:
-        prev = get_test_history(tenant_id, user_id)
-        new_history = prev + [
-            {"role": "user", "content": message_text},
-            {"role": "assistant", "content": final_text},
-        ]
-        save_test_history(tenant_id, user_id, new_history)
+        await append_test_history(
+            tenant_id,
+            user_id,
+            [
+                {"role": "user", "content": message_text},
+                {"role": "assistant", "content": final_text},
+            ],
+        )
     if not is_test and dialog:
-        await save_message(db, tenant_id, user_id, dialog.id, "assistant", final_text)
-    return final_text
+        # Запись не задерживает закрытие потока ([DONE]): отдельная сессия в фоне,
+        # диалог и сообщение пользователя к этому моменту уже закоммичены (перед вызовом модели)
+        assistant_row = {"role": "assistant", "content": final_text, "created_at": datetime.utcnow()}
+        _spawn_background(_save_messages_bg(tenant_id, user_id, dialog.id, [assistant_row]))
 
 
 async def _sse_stream(
@@ -102,9 +356,13 @@ async def _sse_stream(
     is_test: bool = False,
     from_telegram: bool = False,
     is_admin: bool = False,
+    prompt: str | None = None,
+    tenant: TenantInfo | None = None,
 ):
+    yield _SSE_OPEN
+    # Фрагменты ответа уходят клиенту сразу по мере генерации модели
     try:
-        final_text = await _get_chat_reply(
+        async for chunk in _chat_reply_stream(
             tenant_id,
             user_id,
             dialog_id,
@@ -113,16 +371,17 @@ async def _sse_stream(
             is_test=is_test,
             from_telegram=from_telegram,
             is_admin=is_admin,
-        )
+            prompt=prompt,
+            tenant=tenant,
+        ):
+            yield _sse_content(chunk)
     except HTTPException as e:
-        yield f"data: {json.dumps({'error': e.detail})}\n\n"
+        yield _sse_error(str(e.detail))
         return
     except Exception as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield _sse_error(str(e))
         return
-    for i in range(0, len(final_text), _STREAM_CHUNK):
-        yield f"data: {json.dumps({'content': final_text[i:i + _STREAM_CHUNK]})}\n\n"
-    yield "data: [DONE]\n\n"
+    yield _SSE_DONE
 
 
 async def _resolve_is_admin(
@@ -132,56 +391,73 @@ async def _resolve_is_admin(
     if not authorization or not authorization.startswith("Bearer "):
         return False
     token = authorization[7:].strip()
-    payload = decode_jwt(token)
+    payload = decode_jwt_cached(token)
     if not payload:
         return False
     user_id = str(payload.get("sub", ""))
     if not user_id:
         return False
+    # Сам признак кэшируется в is_user_admin_for_tenant (ADMIN_CHECK_TTL_SECONDS) — единственный кэш этой проверки
     return await is_user_admin_for_tenant(db, tenant_id, user_id)
 
 
+async def get_chat_tenant(tenant_id: UUID, db: AsyncSession = Depends(get_db)) -> TenantInfo:
+    """Зависимость эндпоинтов чата: тенант из кэша (один раз на запрос) или 404."""
+    tenant = await get_tenant_cached(db, tenant_id)
+    if not tenant:
+        raise HTTPException(status_code=404, detail="tenant not found")
+    return tenant
+
+
+class ChatCtx(NamedTuple):
+    """Проверенное сообщение и всё, что нужно до вызова модели (общее для SSE и JSON-ответа)."""
+    message_text: str
+    prompt: str
+    is_admin: bool
+
+
+async def _chat_ctx(
+    tenant: TenantInfo, request: ChatRequest, db: AsyncSession, authorization: str | None
+) -> ChatCtx:
+    message_text = request.message
+    if not message_text:
+        raise HTTPException(status_code=400, detail="message must not be empty")
+    too_long = _message_too_long(tenant, message_text)
+    if too_long:
+        raise HTTPException(status_code=400, detail=too_long)
+    # Ошибки, известные до вызова модели (нет файла промпта), отдаём обычным HTTP-ответом, а не кадром SSE.
+    # Промпт и признак администратора независимы — загружаются параллельно (промпт — в своей сессии)
+    prompt, is_admin = await _prompt_alongside(
+        _load_chat_prompt_own_session(tenant, request.is_test),
+        _resolve_is_admin(db, tenant.id, authorization),
+    )
+    return ChatCtx(message_text, prompt, is_admin)
+
+
 @router.post("/{tenant_id:uuid}/chat")
 async def post_message(
     tenant_id: UUID,
     request: ChatRequest,
+    tenant: TenantInfo = Depends(get_chat_tenant),
     db: AsyncSession = Depends(get_db),
     authorization: str | None = Header(None),
 ):
-    message_text = (request.message or "").strip()
-    if not message_text:
-        raise HTTPException(status_code=400, detail="message must not be empty")
-    tenant = await get_tenant_by_id(db, tenant_id)
-    if not tenant:
-        raise HTTPException(status_code=404, detail="tenant not found")
-    # Лимит длины сообщения пользователя берём из настроек тенанта (по умолчанию 500 символов)
-    from app.routers.cabinet import _get_limits_from_settings
-
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
-    max_len = limits["chat_max_user_message_chars"]
-    if len(message_text) > max_len:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Сообщение слишком длинное. Максимум {max_len} символов.",
-        )
-    is_admin = await _resolve_is_admin(db, tenant_id, authorization)
+    ctx = await _chat_ctx(tenant, request, db, authorization)
     return StreamingResponse(
-        _sse_stream(
+        _with_keepalive(_sse_stream(
             tenant_id,
             request.user_id,
             request.dialog_id,
-            message_text,
+            ctx.message_text,
             db,
             is_test=request.is_test,
             from_telegram=False,
-            is_admin=is_admin,
-        ),
+            is_admin=ctx.is_admin,
+            prompt=ctx.prompt,
+            tenant=tenant,
+        )),
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
+        headers=_SSE_HEADERS,
     )
 
 
@@ -189,43 +465,73 @@ async def post_message(
 async def post_message_json(
     tenant_id: UUID,
     request: ChatRequest,
+    tenant: TenantInfo = Depends(get_chat_tenant),
     db: AsyncSession = Depends(get_db),
     authorization: str | None = Header(None),
 ):
     """
     Ответ одним сообщением (JSON). Те же параметры, что и POST .../chat; в ответе — поле reply с полным текстом ответа бота.
     """
-    message_text = (request.message or "").strip()
-    if not message_text:
-        raise HTTPException(status_code=400, detail="message must not be empty")
-    tenant = await get_tenant_by_id(db, tenant_id)
-    if not tenant:
-        raise HTTPException(status_code=404, detail="tenant not found")
-    from app.routers.cabinet import _get_limits_from_settings
-
-    limits = _get_limits_from_settings(getattr(tenant, "settings", None) or {})
-    max_len = limits["chat_max_user_message_chars"]
-    if len(message_text) > max_len:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Сообщение слишком длинное. Максимум {max_len} символов.",
-        )
-    is_admin = await _resolve_is_admin(db, tenant_id, authorization)
+    ctx = await _chat_ctx(tenant, request, db, authorization)
     reply = await _get_chat_reply(
         tenant_id,
         request.user_id,
         request.dialog_id,
-        message_text,
+        ctx.message_text,
         db,
         is_test=request.is_test,
         from_telegram=False,
-        is_admin=is_admin,
+        is_admin=ctx.is_admin,
+        prompt=ctx.prompt,
+        tenant=tenant,
     )
     return ChatMessageResponse(reply=reply)
 
 
+# Один клиент на процесс для Bot API: соединение (TCP + TLS) с api.telegram.org переиспользуется между апдейтами,
+# по HTTP/2 sendMessage/deleteMessage разных чатов идут параллельно по одному соединению
+_tg_client: httpx.AsyncClient | None = None
+
+
+def _get_tg_client() -> httpx.AsyncClient:
+    global _tg_client
+    if _tg_client is None:
+        _tg_client = httpx.AsyncClient(
+            http2=True,
+            timeout=15.0,
+            limits=httpx.Limits(max_connections=500, max_keepalive_connections=200),
+        )
+    return _tg_client
+
+
+@router.on_event("shutdown")
+async def _close_tg_client() -> None:
+    global _tg_client
+    if _tg_client is not None:
+        await _tg_client.aclose()
+        _tg_client = None
+
+
+# Уже принятые апдейты (tenant_id, update_id): Telegram повторяет доставку, если не получил 200 вовремя
+# (перезапуск воркера, сетевой сбой) — повтор не должен вызвать модель и ответить пользователю второй раз
+_TG_SEEN_UPDATES_TTL_SECONDS = 3600
+_tg_seen_updates: TTLCache = TTLCache(maxsize=50000, ttl=_TG_SEEN_UPDATES_TTL_SECONDS)
+
+
+def _telegram_update_seen(tenant_id: UUID, update_id) -> bool:
+    """True, если апдейт уже обрабатывался; иначе запоминает его. Без update_id повтор не распознать."""
+    if update_id is None:
+        return False
+    key = (tenant_id, update_id)
+    if key in _tg_seen_updates:
+        return True
+    _tg_seen_updates[key] = True
+    return False
+
+
 async def _telegram_webhook_handle(tenant_id: UUID, request: Request, db: AsyncSession):
-    """Общая логика webhook: парсим Update, получаем ответ чата, шлём в Telegram через sendMessage."""
+    """Общая логика webhook: парсим Update и запускаем ответ в фоне — Telegram сразу получает 200,
+    а не ждёт модель (иначе при долгом ответе он повторяет доставку апдейта)."""
     try:
         body = await request.json()
     except Exception:
@@ -240,7 +546,9 @@ async def _telegram_webhook_handle(tenant_id: UUID, request: Request, db: AsyncS
     chat_id = chat_obj.get("id")
     if from_id is None or chat_id is None:
         return
-    tenant = await get_tenant_by_id(db, tenant_id)
+    if _telegram_update_seen(tenant_id, body.get("update_id")):
+        return
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         return
     settings = getattr(tenant, "settings", None) or {}
@@ -248,68 +556,118 @@ async def _telegram_webhook_handle(tenant_id: UUID, request: Request, db: AsyncS
     if not bot_token:
         _log.warning("telegram_webhook: tenant %s has no telegram_bot_token", tenant_id)
         return
-    user_id = f"tg_{from_id}"
+    _spawn_background(_telegram_reply(tenant, f"tg_{from_id}", chat_id, text, bot_token))
+
+
+@lru_cache(maxsize=1024)
+def _tg_api_url(bot_token: str, method: str) -> str:
+    """URL метода Bot API (ботов немного — строки собираются один раз)."""
+    return f"https://api.telegram.org/bot{bot_token}/{method}"
+
+
+async def _telegram_send_placeholder(bot_token: str, chat_id: int) -> int | None:
+    """Подтверждение «Запрос получен...»; возвращает message_id (чтобы заменить его ответом) или None."""
+    try:
+        r_place = await _get_tg_client().post(
+            _tg_api_url(bot_token, "sendMessage"),
+            json={
+                "chat_id": chat_id,
+                "text": "Запрос получен, скоро Вам ответят.",
+            },
+            timeout=10.0,
+        )
+        if r_place.status_code == 200:
+            data = r_place.json()
+            if isinstance(data, dict) and data.get("ok") and isinstance(data.get("result"), dict):
+                return data["result"].get("message_id")
+    except Exception as e:
+        _log.warning("telegram placeholder send failed: %s", e)
+    return None
+
+
+async def _telegram_delete_message(bot_token: str, chat_id: int, message_id: int) -> None:
+    try:
+        r_del = await _get_tg_client().post(
+            _tg_api_url(bot_token, "deleteMessage"),
+            json={"chat_id": chat_id, "message_id": message_id},
+        )
+        if r_del.status_code != 200:
+            _log.warning("telegram deleteMessage failed: %s %s", r_del.status_code, r_del.text)
+    except Exception as e:
+        _log.warning("telegram deleteMessage request failed: %s", e)
+
+
+async def _telegram_edit_message(bot_token: str, chat_id: int, message_id: int, text: str) -> bool:
+    """Заменить текст сообщения бота; False — правка не удалась (сообщение удалено, ошибка сети)."""
+    try:
+        r = await _get_tg_client().post(
+            _tg_api_url(bot_token, "editMessageText"),
+            json={"chat_id": chat_id, "message_id": message_id, "text": text},
+        )
+        if r.status_code == 200:
+            return True
+        _log.warning("telegram editMessageText failed: %s %s", r.status_code, r.text)
+    except Exception as e:
+        _log.warning("telegram editMessageText request failed: %s", e)
+    return False
+
+
+async def _telegram_reply(tenant: TenantInfo, user_id: str, chat_id: int, text: str, bot_token: str) -> None:
+    """Ответ на сообщение из Telegram (в фоне): подтверждение, ответ чата в своей сессии БД, ответ в Telegram.
+    Подтверждение отправляется параллельно с вызовом модели, затем его текст заменяется ответом."""
+    tenant_id = tenant.id
     reply_text = ""
-    placeholder_message_id = None  # сообщение «Запрос получен...» — удалим после ответа
+    placeholder_task: asyncio.Task | None = None  # «Запрос получен...» — заменим ответом
     if not text:
         reply_text = "Отправьте текстовое сообщение."
     else:
-        from app.routers.cabinet import _get_limits_from_settings
-        limits = _get_limits_from_settings(settings)
-        if len(text) > limits["chat_max_user_message_chars"]:
-            reply_text = f"Сообщение слишком длинное. Максимум {limits['chat_max_user_message_chars']} символов."
+        too_long = _message_too_long(tenant, text)
+        if too_long:
+            reply_text = too_long
         else:
-            # Сразу отправляем подтверждение; после ответа удалим его
+            placeholder_task = asyncio.create_task(_telegram_send_placeholder(bot_token, chat_id))
+            # Сессия запроса webhook к этому моменту закрыта — открываем свою
             try:
-                async with httpx.AsyncClient(timeout=10.0) as client:
-                    r_place = await client.post(
-                        f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                        json={
-                            "chat_id": chat_id,
-                            "text": "Запрос получен, скоро Вам ответят.",
-                        },
-                    )
-                    if r_place.status_code == 200:
-                        data = r_place.json()
-                        if isinstance(data, dict) and data.get("ok") and isinstance(data.get("result"), dict):
-                            placeholder_message_id = data["result"].get("message_id")
+                async with async_session_maker() as db:
+                    try:
+                        reply_text = await _get_chat_reply(
+                            tenant_id,
+                            user_id,
+                            None,
+                            text,
+                            db,
+                            is_test=False,
+                            from_telegram=True,
+                            is_admin=False,
+                            tenant=tenant,
+                        )
+                    except Exception as e:
+                        _log.exception("telegram_webhook chat reply failed: %s", e)
+                        reply_text = "Ошибка при обработке сообщения. Попробуйте позже."
+                    await db.commit()
             except Exception as e:
-                _log.warning("telegram placeholder send failed: %s", e)
-            try:
-                reply_text = await _get_chat_reply(
-                    tenant_id,
-                    user_id,
-                    None,
-                    text,
-                    db,
-                    is_test=False,
-                    from_telegram=True,
-                    is_admin=False,
-                )
-            except Exception as e:
-                _log.exception("telegram_webhook chat reply failed: %s", e)
-                reply_text = "Ошибка при обработке сообщения. Попробуйте позже."
+                _log.exception("telegram_webhook db session failed: %s", e)
+                reply_text = reply_text or "Ошибка при обработке сообщения. Попробуйте позже."
+    # Подтверждение к этому моменту почти всегда уже доставлено; ждём его, чтобы оно не пришло после ответа
+    placeholder_message_id = await placeholder_task if placeholder_task is not None else None
+    # Ответ заменяет текст подтверждения (один запрос вместо sendMessage + deleteMessage);
+    # если подтверждения нет или правка не удалась — обычный sendMessage
+    if placeholder_message_id is not None and await _telegram_edit_message(
+        bot_token, chat_id, placeholder_message_id, reply_text[:4096]
+    ):
+        return
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.post(
-                f"https://api.telegram.org/bot{bot_token}/sendMessage",
-                json={"chat_id": chat_id, "text": reply_text[:4096]},
-            )
-            if r.status_code != 200:
-                _log.warning("telegram sendMessage failed: %s %s", r.status_code, r.text)
-            # Удаляем сообщение «Запрос получен...», чтобы не засорять чат
-            if placeholder_message_id is not None:
-                try:
-                    r_del = await client.post(
-                        f"https://api.telegram.org/bot{bot_token}/deleteMessage",
-                        json={"chat_id": chat_id, "message_id": placeholder_message_id},
-                    )
-                    if r_del.status_code != 200:
-                        _log.warning("telegram deleteMessage failed: %s %s", r_del.status_code, r_del.text)
-                except Exception as e:
-                    _log.warning("telegram deleteMessage request failed: %s", e)
+        r = await _get_tg_client().post(
+            _tg_api_url(bot_token, "sendMessage"),
+            json={"chat_id": chat_id, "text": reply_text[:4096]},
+        )
+        if r.status_code != 200:
+            _log.warning("telegram sendMessage failed: %s %s", r.status_code, r.text)
     except Exception as e:
         _log.exception("telegram sendMessage request failed: %s", e)
+    # Удаляем сообщение «Запрос получен...», чтобы не засорять чат
+    if placeholder_message_id is not None:
+        _spawn_background(_telegram_delete_message(bot_token, chat_id, placeholder_message_id))
 
 
 @router.post("/by-slug/{slug}/telegram/webhook")
@@ -322,7 +680,7 @@ async def telegram_webhook_by_slug(
     Webhook для Telegram по slug тенанта (например u0cbbedb980f3).
     URL для регистрации в setWebhook показывается в профиле кабинета.
     """
-    tenant = await get_tenant_by_slug(db, slug)
+    tenant = await get_tenant_by_slug_cached(db, slug)
     if not tenant:
         return {}
     await _telegram_webhook_handle(tenant.id, request, db)
@@ -345,13 +703,11 @@ async def telegram_webhook(
 @router.get("/{tenant_id:uuid}/chat/welcome")
 async def get_welcome_message(
     tenant_id: UUID,
+    tenant: TenantInfo = Depends(get_chat_tenant),
     db: AsyncSession = Depends(get_db),
     is_test: bool = False,
 ):
     """Возвращает приветственное сообщение из БД тенанта или из файла по умолчанию (без вызова модели)."""
-    tenant = await get_tenant_by_id(db, tenant_id)
-    if not tenant:
-        raise HTTPException(status_code=404, detail="tenant not found")
     try:
         text = await get_welcome_for_tenant(db, tenant_id, is_test=is_test)
     except FileNotFoundError as e:
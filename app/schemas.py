@@ -1,8 +1,13 @@
 """Pydantic schemas for API."""
 from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
+
+# Ответы, собираемые из ORM-объектов: только чтение (frozen), валидатор строится при первом использовании,
+# а не при импорте модуля (defer_build) — меньше времени старта и памяти воркера
+_ORM_RESPONSE_CONFIG = ConfigDict(from_attributes=True, frozen=True, defer_build=True)
 
 
 # Auth
@@ -45,15 +50,25 @@ class ImpersonateRedeemRequest(BaseModel):
 
 
 # Chat (tenant_id from path)
+# Жёсткая верхняя граница сообщения, общая для всех тенантов (лимит тенанта — chat_max_user_message_chars,
+# проверяется в роутере): заведомо огромное сообщение отклоняется ещё при разборе тела запроса
+CHAT_MESSAGE_MAX_CHARS = 50_000
+
+
 class ChatRequest(BaseModel):
+    # Пробелы по краям срезаются при валидации; пустое после обрезки сообщение отклоняет роутер (400)
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
     user_id: str = Field(..., min_length=1, max_length=64)
-    message: str = Field(..., min_length=1)
+    message: str = Field(..., max_length=CHAT_MESSAGE_MAX_CHARS)
     dialog_id: UUID | None = None
     is_test: bool = False  # режим теста в админке — не сохранять диалоги/сообщения в БД
 
 
 class ChatMessageResponse(BaseModel):
     """Ответ одним сообщением (для клиентов без SSE)."""
+    model_config = ConfigDict(frozen=True)
+
     reply: str
 
 
@@ -69,8 +84,7 @@ class DialogListItem(BaseModel):
     has_lead: bool = False
     archived: bool = False
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
 
 
 class DialogListResponse(BaseModel):
@@ -83,8 +97,7 @@ class MessageInDialog(BaseModel):
     content: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
 
 
 class DialogDetailResponse(BaseModel):
@@ -106,8 +119,7 @@ class SavedItemResponse(BaseModel):
     reference_id: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
 
 
 # Cabinet: profile
@@ -130,8 +142,7 @@ class ProfileResponse(BaseModel):
     # True, если токен бота уже сохранён (сам токен в API не отдаётся)
     telegram_bot_token_set: bool = False
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
 
 
 class ProfileUpdate(BaseModel):
@@ -212,8 +223,7 @@ class LeadResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
 
 
 # Cabinet: embed code for iframe
@@ -226,9 +236,14 @@ class EmbedCodeResponse(BaseModel):
 
 # Admin chat
 class ChatMessage(BaseModel):
-    role: str = Field(..., pattern="^(user|assistant)$")
+    role: Literal["user", "assistant"]
     content: str = Field(..., max_length=8192)
 
+    @field_validator("content", mode="before")
+    @classmethod
+    def _strip_content(cls, v):
+        return v.strip() if isinstance(v, str) else v
+
 
 class AdminChatRequest(BaseModel):
     message: str = Field(..., min_length=1, max_length=4096)
@@ -258,6 +273,8 @@ class McpServerUpdate(BaseModel):
 
 
 class McpToolInfo(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     name: str
     description: str = ""
     inputSchema: dict | None = None
@@ -272,5 +289,4 @@ class McpServerResponse(BaseModel):
     created_at: datetime
     tools: list[McpToolInfo] | None = None  # заполняется при with_tools=true
 
-    class Config:
-        from_attributes = True
+    model_config = _ORM_RESPONSE_CONFIG
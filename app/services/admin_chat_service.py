@@ -1,24 +1,63 @@
 """Админ-чат: диалог-помощник. Единый системный промпт админ-бота из БД или файла.
 В ответе бота блок [SAVE_PROMPT]...[/SAVE_PROMPT] — сохранение промпта бота-пользователя в БД.
 При валидации бот может вернуть JSON с полями validation и reason — парсим и отдаём во фронт."""
+import asyncio
 import json
 import re
+from collections import deque
+from collections.abc import Iterable
+from typing import NamedTuple
 from uuid import UUID
 
+from cachetools import TTLCache
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.attributes import flag_modified
 
+from app.database import call_after_commit
 from app.llm_client import chat_once
-from app.services.prompt_loader import load_admin_prompt, load_test_prompt_for_tenant
+from app.services.prompt_loader import (
+    bump_prompt_version,
+    get_prompt_version,
+    load_admin_prompt,
+    load_test_prompt_for_tenant,
+)
 from app.services.admin_prompt_service import get_admin_system_prompt
-from app.services.cabinet_service import get_tenant_by_id
+from app.services.cabinet_service import get_tenant_by_id, get_tenant_cached, invalidate_tenant_cache
 from app.services.microservices_client import gallery_request, rag_request
 
+
+class AdminHistoryItem(NamedTuple):
+    """Сообщение истории админ-чата (после валидации запроса): кортеж вместо dict — без поиска по ключам."""
+    role: str
+    content: str
+
+
+# Списки галерей и документов в контексте админ-бота меняются только из кабинета (там кэш сбрасывается,
+# см. invalidate_admin_context_cache); в остальных воркерах — устаревание не дольше TTL
+ADMIN_CONTEXT_CACHE_TTL_SECONDS = 60
+_context_lists_cache: TTLCache = TTLCache(maxsize=4096, ttl=ADMIN_CONTEXT_CACHE_TTL_SECONDS)
+_context_lists_inflight: dict[UUID, asyncio.Future] = {}
+
 # Контекстное окно админ-чата: только последнее сообщение (проверка промпта без истории)
 ADMIN_CHAT_CONTEXT_MESSAGE_LIMIT = 1
-
-EXECUTE_BLOCK_RE = re.compile(r"\[EXECUTE\](.*?)\[/EXECUTE\]", re.DOTALL | re.IGNORECASE)
-SAVE_PROMPT_RE = re.compile(r"\[SAVE_PROMPT\](.*?)\[/SAVE_PROMPT\]", re.DOTALL | re.IGNORECASE)
+_HISTORY_ROLES = frozenset(("user", "assistant"))
+
+EXECUTE_BLOCK_RE = re.compile(r"\[EXECUTE\](.*?)\[/EXECUTE\]", re.DOTALL | re.IGNORECASE | re.ASCII)
+SAVE_PROMPT_RE = re.compile(r"\[SAVE_PROMPT\](.*?)\[/SAVE_PROMPT\]", re.DOTALL | re.IGNORECASE | re.ASCII)
+# Разбор ответа валидации (_extract_validation)
+_CODE_BLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```", re.IGNORECASE)
+_COMPACT_VALIDATION_RE = re.compile(
+    r'\{\s*"validation"\s*:\s*(true|false)\s*,\s*"reason"\s*:\s*"((?:[^"\\]|\\.)*)"\s*\}',
+    re.IGNORECASE | re.DOTALL,
+)
+_JSON_DECODER = json.JSONDecoder()
+_REASON_RE = re.compile(r'"reason"\s*:\s*"([^"]*)"')
+
+ADMIN_CHAT_PROMPT_REPLY = "Напишите, чем могу помочь: настроить промпт бота для клиентов?"
+_GREETINGS = frozenset(
+    ("привет", "здравствуйте", "здравствуй", "добрый день", "добрый вечер", "доброе утро", "hi", "hello")
+)
+_GREETING_PUNCTUATION = " !.,)"
 
 ADMIN_SYSTEM_PROMPT_FALLBACK = """Ты — Админ-помощник. Помогаешь настроить промпт чат-бота для клиентов. Промпт редактируется в разделе «Профиль» (системный промпт бота) и «Промпт админ-бота». Веди диалог пошагово, задавай уточняющие вопросы. Администратор команд не вводит."""
 
@@ -34,41 +73,91 @@ async def _get_admin_prompt_assembled(db: AsyncSession, tenant_id: UUID) -> str:
         return ADMIN_SYSTEM_PROMPT_FALLBACK
 
 
-async def _fetch_galleries_and_documents(tenant_id: UUID) -> tuple[list[dict], list[dict]]:
-    """Загружает список галерей и документов RAG тенанта для контекста админ-бота."""
-    galleries: list[dict] = []
-    documents: list[dict] = []
+async def _fetch_galleries(tenant_id: UUID) -> list[dict] | None:
+    """Список галерей тенанта (id, name) из сервиса галереи; None — сервис недоступен или ответил ошибкой."""
     try:
         status, text = await gallery_request(
             "GET", f"/api/v1/groups?tenant_id={tenant_id}", tenant_id
         )
-        if status == 200 and text:
+        if status != 200:
+            return None
+        galleries: list[dict] = []
+        if text:
             data = json.loads(text)
             items = data if isinstance(data, list) else (data.get("items") or data.get("groups") or [])
             for g in items:
                 if isinstance(g, dict):
                     galleries.append({"id": str(g.get("id", "")), "name": str(g.get("name") or g.get("title") or "Без названия")})
+        return galleries
     except (json.JSONDecodeError, Exception):
-        pass
+        return None
+
+
+async def _fetch_documents(tenant_id: UUID) -> list[dict] | None:
+    """Список документов RAG тенанта (id, name) из сервиса RAG; None — сервис недоступен или ответил ошибкой."""
     try:
         status, text = await rag_request(
             "GET", "/api/v1/documents", params={"tenant_id": str(tenant_id)}
         )
-        if status == 200 and text:
+        if status != 200:
+            return None
+        documents: list[dict] = []
+        if text:
             data = json.loads(text)
             items = data if isinstance(data, list) else (data.get("items") or data.get("documents") or [])
             for d in items:
                 if isinstance(d, dict):
                     documents.append({"id": str(d.get("id", "")), "name": str(d.get("name") or d.get("title") or d.get("filename") or "Без названия")})
+        return documents
     except (json.JSONDecodeError, Exception):
-        pass
-    return galleries, documents
+        return None
+
+
+async def _load_galleries_and_documents(tenant_id: UUID) -> tuple[list[dict], list[dict]]:
+    # Сервисы независимы — запросы идут параллельно (время — по более медленному, а не сумма)
+    galleries, documents = await asyncio.gather(_fetch_galleries(tenant_id), _fetch_documents(tenant_id))
+    result = (galleries or [], documents or [])
+    # Ответ с ошибкой сервиса не кэшируем: следующее сообщение попробует снова
+    # Если кэш сбросили, пока шёл запрос, ответ мог устареть — тоже не кэшируем
+    current = _context_lists_inflight.get(tenant_id) is asyncio.current_task()
+    if galleries is not None and documents is not None and current:
+        _context_lists_cache[tenant_id] = result
+    return result
+
+
+def _forget_inflight(tenant_id: UUID, task: asyncio.Future) -> None:
+    if _context_lists_inflight.get(tenant_id) is task:
+        del _context_lists_inflight[tenant_id]
+
+
+def invalidate_admin_context_cache(tenant_id: UUID) -> None:
+    """Сбросить закэшированные списки галерей и документов тенанта. Вызывать после их изменения в кабинете."""
+    _context_lists_cache.pop(tenant_id, None)
+    _context_lists_inflight.pop(tenant_id, None)
+
+
+async def _fetch_galleries_and_documents(tenant_id: UUID) -> tuple[list[dict], list[dict]]:
+    """Список галерей и документов RAG тенанта для контекста админ-бота (из кэша или из сервисов).
+    Одновременные сообщения одного тенанта при промахе кэша ждут один общий запрос к сервисам."""
+    cached = _context_lists_cache.get(tenant_id)
+    if cached is not None:
+        return cached
+    task = _context_lists_inflight.get(tenant_id)
+    if task is None:
+        task = asyncio.ensure_future(_load_galleries_and_documents(tenant_id))
+        _context_lists_inflight[tenant_id] = task
+        task.add_done_callback(lambda t: _forget_inflight(tenant_id, t))
+    # shield: отмена одного ожидающего запроса не отменяет общий
+    return await asyncio.shield(task)
 
 
 async def _get_client_system_prompt(db: AsyncSession, tenant_id: UUID) -> str:
-    """Тестовый промпт бота-клиента (подставляется в контекст админ-бота для проверки)."""
+    """Тестовый промпт бота-клиента (подставляется в контекст админ-бота для проверки).
+    Версия из снимка тенанта: запись кэша промпта другой версии (правка в другом воркере) перечитывается."""
+    tenant = await get_tenant_cached(db, tenant_id)
+    version = get_prompt_version(tenant.settings) if tenant else None
     try:
-        prompt = await load_test_prompt_for_tenant(db, tenant_id)
+        prompt = await load_test_prompt_for_tenant(db, tenant_id, version)
         return (prompt or "(пусто)").strip()
     except FileNotFoundError:
         return "(пусто)"
@@ -85,28 +174,25 @@ def _build_galleries_and_rag_tail(galleries: list[dict], documents: list[dict])
     if not galleries:
         lines.append("  (галерей пока нет)")
     else:
-        for g in galleries:
-            lines.append(f"  — id: {g['id']}, название: {g['name']}")
+        lines.extend(f"  — id: {g['id']}, название: {g['name']}" for g in galleries)
 
     lines.append("")
     lines.append("Список документов RAG у тенанта (если в промпте нет сценария использования документов — предложи добавить):")
     if not documents:
         lines.append("  (документов пока нет)")
     else:
-        for d in documents:
-            lines.append(f"  — id: {d['id']}, название: {d['name']}")
+        lines.extend(f"  — id: {d['id']}, название: {d['name']}" for d in documents)
 
     return "\n".join(lines)
 
 
 def _strip_execute_blocks(reply: str) -> str:
+    # Без «[» блоков заведомо нет: поиск символа дешевле прохода регулярного выражения с IGNORECASE
+    if "[" not in reply:
+        return reply.strip()
     return EXECUTE_BLOCK_RE.sub("", reply).strip()
 
 
-def _strip_save_prompt_blocks(reply: str) -> str:
-    return SAVE_PROMPT_RE.sub("", reply).strip()
-
-
 async def _apply_save_prompt_blocks(db: AsyncSession, tenant_id: UUID, reply: str) -> tuple[str, bool]:
     """
     Ищет в reply блоки [SAVE_PROMPT]...[/SAVE_PROMPT], сохраняет содержимое в боевой промпт
@@ -114,7 +200,12 @@ async def _apply_save_prompt_blocks(db: AsyncSession, tenant_id: UUID, reply: st
     Возвращает (reply без блоков, был ли хотя бы один сохранён).
     """
     saved = False
+    # Один проход по ответу: блоки сохраняются и сразу вырезаются (текст между ними собирается срезами)
+    parts = []
+    last_end = 0
     for m in SAVE_PROMPT_RE.finditer(reply):
+        parts.append(reply[last_end : m.start()])
+        last_end = m.end()
         content = (m.group(1) or "").strip()
         if not content:
             continue
@@ -128,10 +219,14 @@ async def _apply_save_prompt_blocks(db: AsyncSession, tenant_id: UUID, reply: st
                 tenant.settings = settings
                 flag_modified(tenant, "settings")
             tenant.system_prompt = content or None
+            bump_prompt_version(tenant)
+            call_after_commit(db, invalidate_tenant_cache, tenant_id)
             await db.flush()
             saved = True
-    cleaned = _strip_save_prompt_blocks(reply)
-    return cleaned, saved
+    if not parts:
+        return reply.strip(), saved
+    parts.append(reply[last_end:])
+    return "".join(parts).strip(), saved
 
 
 def _extract_validation(reply: str) -> tuple[str, bool | None, str | None]:
@@ -165,49 +260,42 @@ def _extract_validation(reply: str) -> tuple[str, bool | None, str | None]:
         pass
 
     # 2) Извлекаем JSON из блока ```json ... ``` или ``` ... ```
-    code_block_re = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```", re.IGNORECASE)
-    for m in code_block_re.finditer(reply_clean):
+    for m in _CODE_BLOCK_RE.finditer(reply_clean):
         raw = m.group(1).strip()
         try:
             obj = json.loads(raw)
             if apply_validation(obj):
-                reply_clean = code_block_re.sub("", reply_clean, count=1).strip()
+                reply_clean = _CODE_BLOCK_RE.sub("", reply_clean, count=1).strip()
                 reply_clean = ("Промпт требует доработки: " + reason) if not validation and reason else ("Валидация пройдена. " + (reason or ""))
                 return reply_clean, validation, reason
         except (json.JSONDecodeError, TypeError, IndexError):
             continue
 
-    # 3) Ищем первый объект {...} с полем "validation" (по балансу скобок)
+    # Дальше ищется объект с ключом "validation" внутри текста; без такой строки искать нечего
+    if '"validation"' not in reply_clean.lower():
+        return reply_clean, validation, reason
+
+    # 3) Первый объект {...} с полем "validation": raw_decode разбирает JSON с позиции «{» и сам находит
+    # его конец (в C, с учётом скобок внутри строк) — без посимвольного подсчёта скобок в Python
     start = reply_clean.find('{"validation"')
     if start == -1:
         start = reply_clean.find("{")
     if start != -1:
-        depth = 0
-        for i in range(start, len(reply_clean)):
-            if reply_clean[i] == "{":
-                depth += 1
-            elif reply_clean[i] == "}":
-                depth -= 1
-                if depth == 0:
-                    try:
-                        obj = json.loads(reply_clean[start : i + 1])
-                        if apply_validation(obj):
-                            before = reply_clean[:start].strip()
-                            after = reply_clean[i + 1 :].strip()
-                            summary = ("Промпт требует доработки: " + reason) if not validation and reason else ("Валидация пройдена. " + (reason or ""))
-                            parts = [p for p in (before, summary, after) if p]
-                            reply_clean = "\n\n".join(parts) if parts else summary
-                            return reply_clean, validation, reason
-                    except (json.JSONDecodeError, TypeError):
-                        pass
-                    break
+        text = reply_clean  # apply_validation заменяет reply_clean — текст вокруг объекта берём из исходного
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, start)
+            if apply_validation(obj):
+                before = text[:start].strip()
+                after = text[end:].strip()
+                summary = ("Промпт требует доработки: " + reason) if not validation and reason else ("Валидация пройдена. " + (reason or ""))
+                parts = [p for p in (before, summary, after) if p]
+                reply_clean = "\n\n".join(parts) if parts else summary
+                return reply_clean, validation, reason
+        except json.JSONDecodeError:
+            pass
 
     # 4) Regex для компактного JSON в одну строку
-    pattern = re.compile(
-        r'\{\s*"validation"\s*:\s*(true|false)\s*,\s*"reason"\s*:\s*"((?:[^"\\]|\\.)*)"\s*\}',
-        re.IGNORECASE | re.DOTALL,
-    )
-    m = pattern.search(reply_clean)
+    m = _COMPACT_VALIDATION_RE.search(reply_clean)
     if m:
         validation = m.group(1).lower() == "true"
         reason = m.group(2).replace('\\"', '"').strip() or None
@@ -220,7 +308,7 @@ def _extract_validation(reply: str) -> tuple[str, bool | None, str | None]:
     # 5) Fallback: в тексте есть "validation": false — считаем валидацию не пройденной
     if validation is None and ('"validation": false' in reply_clean.lower() or '"validation":false' in reply_clean.lower()):
         validation = False
-        reason_m = re.search(r'"reason"\s*:\s*"([^"]*)"', reply_clean)
+        reason_m = _REASON_RE.search(reply_clean)
         reason = reason_m.group(1).strip() if reason_m else None
 
     return reply_clean, validation, reason
@@ -231,39 +319,48 @@ async def handle_admin_message(
     tenant_id: UUID,
     user_id: str,
     message: str,
-    history: list[dict[str, str]] | None = None,
+    history: Iterable[AdminHistoryItem] | None = None,
 ) -> str:
     """
     Диалог админ-помощника. Бот использует единый системный промпт из БД или файла.
     Блоки [EXECUTE] в ответе удаляются (команды по чанкам отключены).
     """
     text = (message or "").strip()
-    if not text:
-        return "Напишите, чем могу помочь: настроить промпт бота для клиентов?"
-
-    # Промпт админ-бота; в конец промпта админ-бота добавляются списки галерей и RAG
-    admin_prompt = await _get_admin_prompt_assembled(db, tenant_id)
-    galleries, documents = await _fetch_galleries_and_documents(tenant_id)
+    # Пустое сообщение и одно приветствие без вопроса: модели нечего проверять — отвечаем сразу,
+    # без чтения промптов, запросов к галерее/RAG и вызова модели
+    if not text or text.lower().strip(_GREETING_PUNCTUATION) in _GREETINGS:
+        return ADMIN_CHAT_PROMPT_REPLY
+
+    # Списки галерей и RAG (HTTP к сервисам, без сессии БД) запрашиваются сразу и идут параллельно
+    # с чтением промптов; сами промпты читаются последовательно — одна сессия не выполняет два запроса сразу
+    lists_task = asyncio.ensure_future(_fetch_galleries_and_documents(tenant_id))
+    try:
+        # Промпт админ-бота; в конец промпта админ-бота добавляются списки галерей и RAG
+        admin_prompt = await _get_admin_prompt_assembled(db, tenant_id)
+        client_prompt = await _get_client_system_prompt(db, tenant_id)
+        # Дальше до разбора ответа БД не нужна: завершаем транзакцию, соединение возвращается в пул
+        # на время запросов к галерее/RAG и к модели (сессия переподключится при сохранении промпта)
+        await db.commit()
+    except BaseException:
+        lists_task.cancel()
+        raise
+    galleries, documents = await lists_task
     admin_tail = _build_galleries_and_rag_tail(galleries, documents)
-    client_prompt = await _get_client_system_prompt(db, tenant_id)
 
     # Итоговый system: промпт админ-бота + в конце блок галереи/RAG + промпт бота-клиента для проверки
-    system_with_context = (
-        admin_prompt.rstrip()
-        + "\n\n---\n"
-        + admin_tail
-        + "\n\n---\nПромпт бота-клиента (для проверки):\n---\n"
-        + client_prompt
+    # Хвост собирается один раз одним join и переиспользуется и в system, и в логе запроса
+    request_context = "\n\n---\n".join(
+        (admin_tail, f"Промпт бота-клиента (для проверки):\n---\n{client_prompt}")
     )
-    request_context = admin_tail + "\n\n---\nПромпт бота-клиента (для проверки):\n---\n" + client_prompt
+    system_with_context = f"{admin_prompt.rstrip()}\n\n---\n{request_context}"
 
     # Контекстное окно: только последнее сообщение (1 сообщение)
-    messages = []
-    for h in (history or [])[-ADMIN_CHAT_CONTEXT_MESSAGE_LIMIT:]:
-        role = h.get("role", "user")
-        content = (h.get("content") or "").strip()
-        if role in ("user", "assistant") and content:
-            messages.append({"role": role, "content": content})
+    # history может быть генератором: deque с maxlen берёт хвост за один проход без промежуточного списка
+    messages = [
+        {"role": h.role, "content": content}
+        for h in deque(history or (), maxlen=ADMIN_CHAT_CONTEXT_MESSAGE_LIMIT)
+        if h.role in _HISTORY_ROLES and (content := (h.content or "").strip())
+    ]
     messages.append({"role": "user", "content": text})
 
     raw_reply = (await chat_once(system_with_context, messages) or "").strip()
@@ -1,13 +1,17 @@
 """Регистрация, подтверждение по email, логин, JWT."""
+import hashlib
 import secrets
+import time
 import uuid
 from datetime import datetime, timezone, timedelta
 from uuid import UUID
 
 import bcrypt
 import jwt
+from cachetools import TTLCache
 from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from app.config import settings
 from app.models import Tenant, TenantUser
@@ -94,6 +98,27 @@ def decode_jwt(token: str) -> dict | None:
         return None
 
 
+# Кэш расшифрованных JWT: ключ — sha256 токена (сам токен не храним), TTL ограничивает устаревание
+_JWT_CACHE_TTL_SECONDS = 30
+_jwt_cache: TTLCache = TTLCache(maxsize=10_000, ttl=_JWT_CACHE_TTL_SECONDS)
+
+
+def decode_jwt_cached(token: str) -> dict | None:
+    """decode_jwt с кэшем на _JWT_CACHE_TTL_SECONDS. Срок действия (exp) проверяется и при попадании в кэш."""
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    now = time.time()
+    payload = _jwt_cache.get(key)
+    if payload is not None:
+        if payload.get("exp", 0) > now:
+            return payload
+        _jwt_cache.pop(key, None)
+        return None
+    payload = decode_jwt(token)
+    if payload and payload.get("exp", 0) > now:
+        _jwt_cache[key] = payload
+    return payload
+
+
 async def register_new_user_with_tenant(
     db: AsyncSession,
     email: str,
@@ -319,6 +344,23 @@ async def get_tenant_user_by_id(db: AsyncSession, tenant_id: UUID, user_id: str)
     return result.scalar_one_or_none()
 
 
+async def get_tenant_user_with_tenant(db: AsyncSession, tenant_id: UUID, user_id: str) -> TenantUser | None:
+    """TenantUser вместе с его тенантом одним запросом (JOIN): для проверки доступа в кабинет."""
+    try:
+        uid = UUID(user_id)
+    except ValueError:
+        return None
+    result = await db.execute(
+        select(TenantUser)
+        .options(joinedload(TenantUser.tenant))
+        .where(
+            TenantUser.id == uid,
+            TenantUser.tenant_id == tenant_id,
+        )
+    )
+    return result.scalar_one_or_none()
+
+
 async def get_tenant_user_by_primary_key(db: AsyncSession, user_id: UUID) -> TenantUser | None:
     """Найти TenantUser по первичному ключу (id). Нужно для проверки «домашнего» тенанта при имперсонации."""
     result = await db.execute(select(TenantUser).where(TenantUser.id == user_id))
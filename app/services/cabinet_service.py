@@ -1,18 +1,31 @@
 """Cabinet: dialogs list, dialog detail, saved items, profile."""
 import json
 from datetime import date, datetime, timedelta, timezone
+from typing import Any, NamedTuple
 from uuid import UUID
 
-from sqlalchemy import exists, func, or_, select
+from cachetools import TTLCache
+from sqlalchemy import delete, exists, func, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings as app_settings
 from app.models import Dialog, DialogView, Lead, McpServer, Message, SavedItem, UserProfile
 from app.services.auth_service import get_tenant_user_by_id, get_tenant_user_by_primary_key
+from app.services.prompt_loader import invalidate_prompt_cache
 
 
 PREVIEW_MAX_LEN = 120
 
+# INSERT ... ON CONFLICT по диалекту сессии: PostgreSQL в работе, SQLite в тестах (API on_conflict_do_update одинаковый)
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+# Признак администратора по (tenant_id, user_id): проверяется на каждом сообщении авторизованного чата
+ADMIN_CHECK_TTL_SECONDS = 30
+_admin_check_cache: TTLCache = TTLCache(maxsize=10_000, ttl=ADMIN_CHECK_TTL_SECONDS)
+
 
 async def is_user_admin_for_tenant(
     db: AsyncSession, tenant_id: UUID, user_id_str: str
@@ -20,8 +33,19 @@ async def is_user_admin_for_tenant(
     """
     Проверяет, является ли пользователь администратором (для текущего или домашнего тенанта).
     Используется для включения логирования обменов с DeepSeek только для админов.
+    Результат кэшируется на ADMIN_CHECK_TTL_SECONDS, тенанты берутся из кэша тенантов.
     """
-    tenant = await get_tenant_by_id(db, tenant_id)
+    key = (tenant_id, user_id_str)
+    cached = _admin_check_cache.get(key)
+    if cached is not None:
+        return cached
+    result = await _check_user_admin_for_tenant(db, tenant_id, user_id_str)
+    _admin_check_cache[key] = result
+    return result
+
+
+async def _check_user_admin_for_tenant(db: AsyncSession, tenant_id: UUID, user_id_str: str) -> bool:
+    tenant = await get_tenant_cached(db, tenant_id)
     if not tenant:
         return False
     admin_slug = (app_settings.admin_tenant_slug or "").strip()
@@ -36,7 +60,7 @@ async def is_user_admin_for_tenant(
     home_user = await get_tenant_user_by_primary_key(db, uid)
     if not home_user:
         return False
-    home_tenant = await get_tenant_by_id(db, home_user.tenant_id)
+    home_tenant = await get_tenant_cached(db, home_user.tenant_id)
     return bool(home_tenant and home_tenant.slug == admin_slug)
 
 
@@ -52,6 +76,60 @@ async def get_tenant_by_id(db: AsyncSession, tenant_id: UUID):
     return result.scalar_one_or_none()
 
 
+class TenantInfo(NamedTuple):
+    """Снимок тенанта для read-only проверок (существование, slug, лимиты из settings)."""
+    id: UUID
+    slug: str
+    name: str
+    settings: dict[str, Any]
+
+
+# Тенанты меняются редко: кэшируем снимки на TTL_SECONDS, при изменении тенанта — invalidate_tenant_cache
+# после коммита (call_after_commit). Кэш свой в каждом воркере: в других воркерах изменение
+# (настройки, блокировка) видно не позже чем через TENANT_CACHE_TTL_SECONDS.
+TENANT_CACHE_TTL_SECONDS = 60
+_tenant_cache: TTLCache = TTLCache(maxsize=2048, ttl=TENANT_CACHE_TTL_SECONDS)
+_tenant_slug_cache: TTLCache = TTLCache(maxsize=2048, ttl=TENANT_CACHE_TTL_SECONDS)
+
+
+def _tenant_info(tenant) -> TenantInfo:
+    info = TenantInfo(
+        id=tenant.id,
+        slug=tenant.slug,
+        name=tenant.name,
+        settings=dict(tenant.settings or {}),
+    )
+    _tenant_cache[info.id] = info
+    _tenant_slug_cache[info.slug] = info
+    return info
+
+
+async def get_tenant_cached(db: AsyncSession, tenant_id: UUID) -> TenantInfo | None:
+    """Тенант из кэша или БД. Только для чтения: для изменений используйте get_tenant_by_id."""
+    info = _tenant_cache.get(tenant_id)
+    if info is not None:
+        return info
+    tenant = await get_tenant_by_id(db, tenant_id)
+    return _tenant_info(tenant) if tenant else None
+
+
+async def get_tenant_by_slug_cached(db: AsyncSession, slug: str) -> TenantInfo | None:
+    """Тенант по slug из кэша или БД. Только для чтения."""
+    info = _tenant_slug_cache.get(slug)
+    if info is not None:
+        return info
+    tenant = await get_tenant_by_slug(db, slug)
+    return _tenant_info(tenant) if tenant else None
+
+
+def invalidate_tenant_cache(tenant_id: UUID) -> None:
+    """Сбросить снимок тенанта и его закэшированные промпты после изменения (settings, промпт, блокировка)."""
+    info = _tenant_cache.pop(tenant_id, None)
+    if info is not None:
+        _tenant_slug_cache.pop(info.slug, None)
+    invalidate_prompt_cache(tenant_id)
+
+
 async def get_first_confirmed_user_of_tenant(db: AsyncSession, tenant_id: UUID):
     """Первый подтверждённый пользователь тенанта (для входа администратора в кабинет тенанта)."""
     from app.models import TenantUser
@@ -89,6 +167,26 @@ async def list_all_tenants(
     return total, list(result.scalars().all())
 
 
+async def _last_message_previews(db: AsyncSession, dialog_ids: list[UUID]) -> dict[UUID, str | None]:
+    """Превью последнего сообщения для страницы диалогов одним запросом (вместо SELECT на диалог).
+    Последнее сообщение — row_number() по диалогу: работает и в PostgreSQL, и в SQLite (тесты)."""
+    if not dialog_ids:
+        return {}
+    ranked = (
+        select(
+            Message.dialog_id,
+            Message.content,
+            func.row_number()
+            .over(partition_by=Message.dialog_id, order_by=Message.created_at.desc())
+            .label("rn"),
+        )
+        .where(Message.dialog_id.in_(dialog_ids))
+        .subquery()
+    )
+    result = await db.execute(select(ranked.c.dialog_id, ranked.c.content).where(ranked.c.rn == 1))
+    return {row[0]: (row[1] or "")[:PREVIEW_MAX_LEN] or None for row in result.all()}
+
+
 async def list_dialogs(
     db: AsyncSession,
     tenant_id: UUID,
@@ -110,20 +208,8 @@ async def list_dialogs(
     )
     result = await db.execute(q)
     dialogs = result.scalars().all()
-    items = []
-    for d in dialogs:
-        preview = None
-        msg_q = (
-            select(Message.content)
-            .where(Message.dialog_id == d.id)
-            .order_by(Message.created_at.desc())
-            .limit(1)
-        )
-        msg_result = await db.execute(msg_q)
-        row = msg_result.scalar_one_or_none()
-        if row:
-            preview = (row[0] or "")[:PREVIEW_MAX_LEN] or None
-        items.append({"dialog": d, "preview": preview})
+    previews = await _last_message_previews(db, [d.id for d in dialogs])
+    items = [{"dialog": d, "preview": previews.get(d.id)} for d in dialogs]
     return total, items
 
 
@@ -181,23 +267,30 @@ async def list_tenant_dialogs(
         )
         for row in dv_result.all():
             viewed_map[row[0]] = row[1]
+    # Количество сообщений — одним запросом с GROUP BY вместо COUNT на каждый диалог
+    count_map: dict[UUID, int] = {}
+    if dialog_ids:
+        cnt_result = await db.execute(
+            select(Message.dialog_id, func.count())
+            .where(Message.dialog_id.in_(dialog_ids))
+            .group_by(Message.dialog_id)
+        )
+        count_map = dict(cnt_result.all())
+    # Диалоги с лидом — одним запросом в множество вместо EXISTS на каждый диалог
+    lead_dialog_ids: set[UUID] = set()
+    if dialog_ids:
+        lead_result = await db.execute(
+            select(Lead.dialog_id)
+            .where(Lead.tenant_id == tenant_id, Lead.dialog_id.in_(dialog_ids))
+            .distinct()
+        )
+        lead_dialog_ids = set(lead_result.scalars().all())
+    previews = await _last_message_previews(db, dialog_ids)
     items = []
     for d in dialogs:
-        preview = None
-        msg_q = (
-            select(Message.content)
-            .where(Message.dialog_id == d.id)
-            .order_by(Message.created_at.desc())
-            .limit(1)
-        )
-        msg_result = await db.execute(msg_q)
-        row = msg_result.scalar_one_or_none()
-        if row:
-            preview = (row[0] or "")[:PREVIEW_MAX_LEN] or None
-        cnt_result = await db.execute(select(func.count()).select_from(Message).where(Message.dialog_id == d.id))
-        message_count = cnt_result.scalar() or 0
-        lead_exists = await db.execute(select(exists().where(Lead.dialog_id == d.id, Lead.tenant_id == tenant_id)))
-        has_lead = lead_exists.scalar() or False
+        preview = previews.get(d.id)
+        message_count = count_map.get(d.id, 0)
+        has_lead = d.id in lead_dialog_ids
         items.append({
             "dialog": d,
             "preview": preview,
@@ -353,6 +446,23 @@ async def get_saved_by_id(
     return result.scalar_one_or_none()
 
 
+async def delete_saved_item(
+    db: AsyncSession,
+    tenant_id: UUID,
+    user_id: str,
+    saved_id: UUID,
+) -> bool:
+    """Удалить сохранённый элемент одним DELETE (без предварительного SELECT). True — если элемент был."""
+    result = await db.execute(
+        delete(SavedItem).where(
+            SavedItem.id == saved_id,
+            SavedItem.tenant_id == tenant_id,
+            SavedItem.user_id == user_id,
+        )
+    )
+    return result.rowcount > 0
+
+
 async def list_leads(
     db: AsyncSession,
     tenant_id: UUID,
@@ -394,17 +504,26 @@ async def upsert_profile(
     display_name: str | None = None,
     contact: str | None = None,
 ) -> UserProfile:
-    profile = await get_profile(db, tenant_id, user_id)
-    if profile is None:
-        profile = UserProfile(tenant_id=tenant_id, user_id=user_id)
-        db.add(profile)
-        await db.flush()
+    """INSERT ... ON CONFLICT DO UPDATE: один запрос вместо SELECT + INSERT/UPDATE, без гонки при создании."""
+    now = datetime.utcnow()
+    values: dict[str, Any] = {"tenant_id": tenant_id, "user_id": user_id, "updated_at": now}
+    updates: dict[str, Any] = {"updated_at": now}
     if display_name is not None:
-        profile.display_name = display_name
+        values["display_name"] = updates["display_name"] = display_name
     if contact is not None:
-        profile.contact = contact
-    await db.flush()
-    return profile
+        values["contact"] = updates["contact"] = contact
+    upsert_insert = _UPSERT_INSERTS[db.get_bind().dialect.name]
+    stmt = (
+        upsert_insert(UserProfile)
+        .values(**values)
+        .on_conflict_do_update(
+            index_elements=[UserProfile.tenant_id, UserProfile.user_id],
+            set_=updates,
+        )
+        .returning(UserProfile)
+    )
+    result = await db.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalar_one()
 
 
 # MCP servers
@@ -1,9 +1,10 @@
 """Chat: get/create dialog, save message, get history for LLM."""
 from uuid import UUID
 
-from sqlalchemy import delete, select
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database import async_session_maker
 from app.models import Dialog, DialogView, Message
 
 
@@ -67,17 +68,52 @@ async def save_message(
     await db.flush()
 
 
-async def get_dialog_messages_for_llm(
-    db: AsyncSession, dialog_id: UUID, tenant_id: UUID
-) -> list[dict[str, str]]:
-    """История диалога для LLM. Фильтр по tenant_id — изоляция данных тенанта."""
+async def save_messages_bulk(
+    db: AsyncSession,
+    tenant_id: UUID,
+    user_id: str,
+    dialog_id: UUID,
+    rows: list[dict],
+) -> None:
+    """Несколько сообщений диалога одним INSERT (rows: role, content, created_at) и одно снятие «просмотрено»."""
+    await db.execute(
+        insert(Message),
+        [{"tenant_id": tenant_id, "user_id": user_id, "dialog_id": dialog_id, **row} for row in rows],
+    )
+    await db.execute(
+        delete(DialogView).where(
+            DialogView.tenant_id == tenant_id,
+            DialogView.dialog_id == dialog_id,
+        )
+    )
+
+
+async def save_messages_bulk_own_session(
+    tenant_id: UUID,
+    user_id: str,
+    dialog_id: UUID,
+    rows: list[dict],
+) -> None:
+    """save_messages_bulk в отдельной сессии с коммитом — для записи после того, как сессия запроса закрыта."""
+    async with async_session_maker() as db:
+        await save_messages_bulk(db, tenant_id, user_id, dialog_id, rows)
+        await db.commit()
+
+
+async def get_dialog_tail_for_llm(
+    db: AsyncSession, dialog_id: UUID, tenant_id: UUID, limit: int
+) -> tuple[list[dict[str, str]], int]:
+    """Последние limit сообщений диалога для LLM (в порядке времени) и общее число сообщений — одним запросом.
+    Длинный диалог не читается целиком ради нескольких последних сообщений (индекс ix_message_dialog_created)."""
     result = await db.execute(
-        select(Message.role, Message.content)
+        select(Message.role, Message.content, func.count().over().label("total"))
         .where(Message.dialog_id == dialog_id, Message.tenant_id == tenant_id)
-        .order_by(Message.created_at)
+        .order_by(Message.created_at.desc())
+        .limit(limit)
     )
     rows = result.all()
-    return [{"role": r.role, "content": r.content} for r in rows]
+    total = rows[0].total if rows else 0
+    return [{"role": r.role, "content": r.content} for r in reversed(rows)], total
 
 
 async def clear_tenant_prod_history(db: AsyncSession, tenant_id: UUID) -> None:
@@ -6,6 +6,7 @@ from uuid import UUID
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.database import async_session_maker
 from app.models import Lead
 
 EMAIL_RE = re.compile(
@@ -18,6 +19,15 @@ PHONE_RE = re.compile(
 )
 
 
+# Оба шаблона одной альтернативой: проверка «есть ли контакт» — один проход по тексту вместо двух
+_CONTACT_RE = re.compile(f"(?:{EMAIL_RE.pattern})|(?:{PHONE_RE.pattern})", re.IGNORECASE)
+
+
+def has_contact(text: str) -> bool:
+    """Есть ли в тексте email или телефон (без обращения к БД)."""
+    return _CONTACT_RE.search(text) is not None
+
+
 def _extract_contact_parts(text: str) -> list[str]:
     parts = []
     seen = set()
@@ -109,3 +119,17 @@ async def save_lead_if_contact(
     db.add(lead)
     await db.flush()
     return True
+
+
+async def save_lead_if_contact_own_session(
+    tenant_id: UUID,
+    user_id: str,
+    dialog_id: UUID,
+    user_message: str,
+) -> bool:
+    """То же, что save_lead_if_contact, но в отдельной сессии (своё соединение из пула) с коммитом.
+    Можно выполнять параллельно с записями в сессии запроса; диалог к этому моменту должен быть закоммичен."""
+    async with async_session_maker() as db:
+        saved = await save_lead_if_contact(db, tenant_id, user_id, dialog_id, user_message)
+        await db.commit()
+        return saved
@@ -1,13 +1,24 @@
 """Единое логирование обменов с DeepSeek: запрос и ответ по типам чата в раздельные директории.
 Вызов append_exchange делается вызывающим кодом: prodchat (iframe) и telegramchat (Telegram) логируются всегда,
 testchat и adminchat — только для администратора."""
+import asyncio
+import logging
+import os
+import re
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from uuid import UUID
 
 from app.config import PROJECT_ROOT
 
+_log = logging.getLogger(__name__)
+
 SEP_LINE = "#" * 60
+_UTC = timezone.utc
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S UTC"
+_REQUEST_HEADER = "=== REQUEST TO DEEPSEEK ===\n"
+_RESPONSE_HEADER = f"\n{SEP_LINE}\n=== RESPONSE FROM DEEPSEEK ===\n"
 
 # Поддиректории под logs/: testchat, prodchat (iframe), telegramchat (Telegram), adminchat
 CHAT_TYPE_DIRS = ("testchat", "prodchat", "telegramchat", "adminchat")
@@ -20,10 +31,95 @@ def _log_dir(chat_type: str) -> Path:
     return PROJECT_ROOT / "logs" / chat_type
 
 
+# Запись в файлы не блокирует цикл событий: append_exchange копит готовый текст по файлам, одна фоновая
+# задача на процесс раз в _FLUSH_INTERVAL_SECONDS забирает накопленное и дописывает его в потоке —
+# один open на файл за пачку. Директории создаются один раз за процесс.
+_FLUSH_INTERVAL_SECONDS = 0.05
+_pending: dict[Path, list[str]] = {}
+_wakeup: asyncio.Event | None = None
+_writer_task: asyncio.Task | None = None
+_created_dirs: set[Path] = set()
+_APPEND_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_CLOEXEC", 0)
+
+
+def _append(path: Path, data: bytes) -> None:
+    if path.parent not in _created_dirs:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(path.parent)
+    # Одна запись в конец файла без буферизованного текстового слоя (TextIOWrapper + BufferedWriter)
+    fd = os.open(path, _APPEND_FLAGS, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _write_batch(batch: dict[Path, list[str]]) -> None:
+    """Дописать пачку по файлам. Ошибка одного файла логируется и не мешает остальным (и следующим пачкам)."""
+    for path, parts in batch.items():
+        try:
+            data = "".join(parts).encode("utf-8", "replace")
+            try:
+                _append(path, data)
+            except FileNotFoundError:
+                # Директорию удалили (очистка, ротация логов) после того, как она была создана: создаём заново
+                _created_dirs.discard(path.parent)
+                _append(path, data)
+        except Exception:
+            _log.exception("failed to write LLM exchange log %s", path)
+
+
+def _take_pending() -> dict[Path, list[str]]:
+    global _pending
+    batch, _pending = _pending, {}
+    return batch
+
+
+async def _writer(wakeup: asyncio.Event) -> None:
+    while True:
+        await wakeup.wait()
+        await asyncio.sleep(_FLUSH_INTERVAL_SECONDS)
+        wakeup.clear()
+        batch = _take_pending()
+        if batch:
+            # Задача живёт весь процесс: любая ошибка пачки только логируется, следующие записи не теряются
+            try:
+                await asyncio.to_thread(_write_batch, batch)
+            except Exception:
+                _log.exception("failed to write LLM exchange log batch")
+
+
+def _enqueue(path: Path, parts: tuple[str, ...]) -> None:
+    """Добавить запись к очередной пачке; вне цикла событий (скрипты) — записать сразу."""
+    global _wakeup, _writer_task
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _write_batch({path: list(parts)})
+        return
+    _pending.setdefault(path, []).extend(parts)
+    if _writer_task is None or _writer_task.done():
+        _wakeup = asyncio.Event()
+        _writer_task = asyncio.create_task(_writer(_wakeup))
+    _wakeup.set()
+
+
+async def flush_exchange_logs() -> None:
+    """Дописать всё накопленное (при остановке приложения)."""
+    batch = _take_pending()
+    if batch:
+        await asyncio.to_thread(_write_batch, batch)
+
+
+# В имени файла из session_id остаются буквы, цифры, «-» и «_» (\w в str — буквы и цифры Unicode и «_»)
+_UNSAFE_SID_CHARS_RE = re.compile(r"[^\w-]")
+
+
+@lru_cache(maxsize=4096)
 def _session_log_path(tenant_id: UUID, session_id: str, chat_type: str) -> Path:
+    """Файл лога сессии. Путь стабилен для сессии — вычисляется один раз на (тенант, сессия, тип чата)."""
     log_dir = _log_dir(chat_type)
-    log_dir.mkdir(parents=True, exist_ok=True)
-    safe_sid = "".join(c for c in session_id if c.isalnum() or c in "-_")
+    safe_sid = _UNSAFE_SID_CHARS_RE.sub("", session_id)
     return log_dir / f"{tenant_id}_{safe_sid}.log"
 
 
@@ -45,22 +141,10 @@ def append_exchange(
     if chat_type not in CHAT_TYPE_DIRS:
         chat_type = "prodchat"
     path = _session_log_path(tenant_id, session_id, chat_type)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-    block = (
-        "=== REQUEST TO DEEPSEEK ===\n"
-        f"{request_to_llm}\n"
-        f"{SEP_LINE}\n"
-        "=== RESPONSE FROM DEEPSEEK ===\n"
-        f"{response_from_llm}\n"
-    )
     if is_new_session:
-        header = f"tenant_id={tenant_id} session_id={session_id} started={ts}\n{SEP_LINE}\n"
-        content = header + block
+        ts = datetime.now(_UTC).strftime(_TS_FORMAT)
+        prefix = f"tenant_id={tenant_id} session_id={session_id} started={ts}\n{SEP_LINE}\n"
     else:
-        content = "\n" + block
-    try:
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(content)
-    except OSError:
-        pass
+        prefix = "\n"
+    # Части блока уходят в пачку как есть: текст запроса и ответа склеивается один раз — при записи пачки
+    _enqueue(path, (prefix, _REQUEST_HEADER, request_to_llm, _RESPONSE_HEADER, response_from_llm, "\n"))
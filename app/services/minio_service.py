@@ -1,5 +1,6 @@
 """Загрузка файлов в MinIO для галереи и прочих нужд кабинета."""
-import io
+from functools import lru_cache
+from typing import BinaryIO
 from uuid import uuid4
 
 from minio import Minio
@@ -7,7 +8,9 @@ from minio import Minio
 from app.config import settings
 
 
+@lru_cache(maxsize=1)
 def get_minio_client() -> Minio:
+    """Один клиент на процесс: пул соединений urllib3 и кэш регионов переиспользуются между запросами."""
     return Minio(
         settings.minio_endpoint,
         access_key=settings.minio_access_key,
@@ -16,10 +19,18 @@ def get_minio_client() -> Minio:
     )
 
 
+_bucket_ready = False
+
+
 def ensure_bucket() -> None:
+    """Создаёт бакет при необходимости; после первой успешной проверки повторно не обращается к MinIO."""
+    global _bucket_ready
+    if _bucket_ready:
+        return
     client = get_minio_client()
     if not client.bucket_exists(settings.minio_bucket):
         client.make_bucket(settings.minio_bucket)
+    _bucket_ready = True
 
 
 # Допустимые MIME для изображений галереи
@@ -32,8 +43,12 @@ ALLOWED_IMAGE_CONTENT_TYPES = {
 ALLOWED_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
 
 
-def upload_gallery_image(tenant_id: str, file_data: bytes, content_type: str, original_filename: str) -> str:
-    """Загружает изображение в MinIO, ключ: gallery/{tenant_id}/{uuid}.ext. Возвращает object_key."""
+# Размер части multipart-загрузки: в памяти держится не больше одной части
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+
+def upload_gallery_image(tenant_id: str, file_obj: BinaryIO, content_type: str, original_filename: str) -> str:
+    """Загружает изображение в MinIO потоково (multipart), ключ: gallery/{tenant_id}/{uuid}.ext. Возвращает object_key."""
     if content_type not in ALLOWED_IMAGE_CONTENT_TYPES:
         raise ValueError(f"Недопустимый тип изображения: {content_type}")
     ext = ".jpg"
@@ -47,8 +62,9 @@ def upload_gallery_image(tenant_id: str, file_data: bytes, content_type: str, or
     client.put_object(
         settings.minio_bucket,
         object_name,
-        io.BytesIO(file_data),
-        length=len(file_data),
+        file_obj,
+        length=-1,
+        part_size=UPLOAD_PART_SIZE,
         content_type=content_type,
     )
     return object_name
@@ -3,6 +3,7 @@
 from pathlib import Path
 from uuid import UUID
 
+from cachetools import TTLCache
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -10,19 +11,85 @@ from app.config import settings
 from app.models import Tenant
 
 
+# Файлы промптов по умолчанию читаются с диска один раз и перечитываются только после изменения (mtime):
+# на повторных запросах вместо чтения и декодирования файла — один stat
+_file_cache: dict[Path, tuple[float, str]] = {}
+
+
+def _read_text_cached(path: Path, missing_message: str) -> str:
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        raise FileNotFoundError(f"{missing_message}: {path}")
+    cached = _file_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    text = path.read_text(encoding="utf-8")
+    _file_cache[path] = (mtime, text)
+    return text
+
+
 def load_prompt(base_dir: Path | None = None) -> str:
     """Промпт по умолчанию из файла (для восстановления и fallback)."""
-    path = settings.get_prompt_path(base_dir)
-    if not path.exists():
-        raise FileNotFoundError(f"Prompt file not found: {path}")
-    return path.read_text(encoding="utf-8")
+    return _read_text_cached(settings.get_prompt_path(base_dir), "Prompt file not found")
+
+
+# Промпты меняются только при редактировании в кабинете: кэшируем итоговый текст по (tenant_id, is_test)
+# вместе с версией промпта (tenant.settings['prompt_version'], см. bump_prompt_version).
+# В своём процессе сброс — invalidate_prompt_cache (вызывается из invalidate_tenant_cache); другие воркеры
+# видят новую версию вместе с обновлением кэша тенанта и перечитывают промпт, не дожидаясь TTL.
+PROMPT_CACHE_TTL_SECONDS = 300
+_prompt_cache: TTLCache = TTLCache(maxsize=4096, ttl=PROMPT_CACHE_TTL_SECONDS)
+
 
+def get_prompt_version(tenant_settings: dict | None) -> int:
+    """Версия промпта тенанта из tenant.settings (0 — промпт ни разу не менялся после введения версий)."""
+    return int((tenant_settings or {}).get("prompt_version") or 0)
 
-async def load_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
+
+def bump_prompt_version(tenant: Tenant) -> None:
+    """Увеличить версию промпта. Вызывать при любом изменении system_prompt или test_system_prompt."""
+    s = dict(tenant.settings or {})
+    s["prompt_version"] = get_prompt_version(s) + 1
+    tenant.settings = s
+
+
+def invalidate_prompt_cache(tenant_id: UUID) -> None:
+    """Сбросить закэшированные боевой и тестовый промпты тенанта."""
+    _prompt_cache.pop((tenant_id, False), None)
+    _prompt_cache.pop((tenant_id, True), None)
+
+
+async def load_prompt_for_tenant(db: AsyncSession, tenant_id: UUID, version: int | None = None) -> str:
     """
     Промпт пользовательского чат-бота для тенанта.
     Используется единый системный промпт из tenant.system_prompt; если пусто — из файла.
+    version — версия промпта из уже загруженного тенанта; при несовпадении с закэшированной промпт перечитывается.
     """
+    key = (tenant_id, False)
+    cached = _prompt_cache.get(key)
+    if cached is not None and (version is None or cached[0] == version):
+        return cached[1]
+    prompt = await _read_prompt_for_tenant(db, tenant_id)
+    _prompt_cache[key] = (version, prompt)
+    return prompt
+
+
+async def load_test_prompt_for_tenant(db: AsyncSession, tenant_id: UUID, version: int | None = None) -> str:
+    """
+    Тестовый промпт пользовательского чат-бота.
+    Берётся из tenant.settings['test_system_prompt'], если есть, иначе — как боевой.
+    """
+    key = (tenant_id, True)
+    cached = _prompt_cache.get(key)
+    if cached is not None and (version is None or cached[0] == version):
+        return cached[1]
+    prompt = await _read_test_prompt_for_tenant(db, tenant_id)
+    _prompt_cache[key] = (version, prompt)
+    return prompt
+
+
+async def _read_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
     r = await db.execute(select(Tenant.system_prompt).where(Tenant.id == tenant_id))
     row = r.one_or_none()
     base = (row[0] or "").strip() if row else ""
@@ -31,17 +98,11 @@ async def load_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
     return load_prompt()
 
 
-async def load_test_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
-    """
-    Тестовый промпт пользовательского чат-бота.
-    Берётся из tenant.settings['test_system_prompt'], если есть, иначе — как боевой.
-    """
-    from app.models import Tenant
-
+async def _read_test_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
     r = await db.execute(select(Tenant.settings, Tenant.system_prompt).where(Tenant.id == tenant_id))
     row = r.one_or_none()
     if not row:
-        return await load_prompt_for_tenant(db, tenant_id)
+        return await _read_prompt_for_tenant(db, tenant_id)
     settings, prod = row
     test = ""
     if isinstance(settings, dict):
@@ -56,10 +117,7 @@ async def load_test_prompt_for_tenant(db: AsyncSession, tenant_id: UUID) -> str:
 
 def load_welcome_message_from_file(base_dir: Path | None = None) -> str:
     """Приветствие по умолчанию из файла (показывается при открытии чата)."""
-    path = settings.get_welcome_message_path(base_dir)
-    if not path.exists():
-        raise FileNotFoundError(f"Welcome message file not found: {path}")
-    return path.read_text(encoding="utf-8").strip()
+    return _read_text_cached(settings.get_welcome_message_path(base_dir), "Welcome message file not found").strip()
 
 
 async def get_welcome_for_tenant(
@@ -82,7 +140,4 @@ async def get_welcome_for_tenant(
 
 def load_admin_prompt(base_dir: Path | None = None) -> str:
     """Промпт агента в личном кабинете."""
-    path = settings.get_admin_prompt_path(base_dir)
-    if not path.exists():
-        raise FileNotFoundError(f"Admin prompt file not found: {path}")
-    return path.read_text(encoding="utf-8")
+    return _read_text_cached(settings.get_admin_prompt_path(base_dir), "Admin prompt file not found")
@@ -0,0 +1,14 @@
+"""Общий клиент Redis (если задан REDIS_URL): история тестового чата, кэш ответов."""
+from functools import lru_cache
+
+from redis import asyncio as aioredis
+
+from app.config import settings
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> aioredis.Redis | None:
+    """Один клиент (и пул соединений) на процесс; None — Redis не настроен, используется память процесса."""
+    if not settings.redis_url:
+        return None
+    return aioredis.from_url(settings.redis_url)
@@ -0,0 +1,80 @@
+"""Кэш ответов бота на первое сообщение диалога (частые одинаковые вопросы: «здравствуйте», «сколько стоит»).
+
+Включается для тенанта настройкой tenant.settings['response_cache_ttl_seconds'] (0 или нет — выключено).
+Ключ — хеш (тенант, промпт, канал, нормализованный текст вопроса); кэшируются только ответы без предыдущей
+истории, поэтому контекст диалога на ответ не влияет. Хранилище — Redis (если задан REDIS_URL), иначе память процесса.
+"""
+import asyncio
+import hashlib
+from uuid import UUID
+
+from cachetools import TLRUCache
+
+from app.services.redis_client import get_redis
+
+_REDIS_KEY_PREFIX = "reply_cache"
+# Верхняя граница TTL, чтобы ошибочная настройка не закрепила ответ навсегда
+MAX_RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Значение — (ответ, ttl): у каждого тенанта свой срок жизни записи
+_local: TLRUCache[str, tuple[str, int]] = TLRUCache(
+    maxsize=4096,
+    ttu=lambda _key, value, now: now + value[1],
+)
+
+
+# Запросы, ответ на которые сейчас генерируется: одинаковые вопросы, пришедшие одновременно
+# (до того как ответ попал в кэш), ждут один вызов модели вместо того, чтобы делать свой
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def get_response_cache_ttl(tenant_settings: dict | None) -> int:
+    """TTL кэша ответов тенанта в секундах; 0 — кэш выключен."""
+    try:
+        ttl = int((tenant_settings or {}).get("response_cache_ttl_seconds") or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, min(ttl, MAX_RESPONSE_CACHE_TTL_SECONDS))
+
+
+def make_response_cache_key(tenant_id: UUID, prompt: str, message_text: str, from_telegram: bool) -> str:
+    """Ключ по тенанту, промпту, каналу и вопросу (регистр и лишние пробелы не важны)."""
+    normalized = " ".join(message_text.lower().split())
+    raw = "\x00".join((str(tenant_id), prompt, "tg" if from_telegram else "web", normalized))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def get_cached_response(key: str) -> str | None:
+    r = get_redis()
+    if r is None:
+        entry = _local.get(key)
+        return entry[0] if entry else None
+    value = await r.get(f"{_REDIS_KEY_PREFIX}:{key}")
+    return value.decode("utf-8") if value is not None else None
+
+
+async def set_cached_response(key: str, text: str, ttl: int) -> None:
+    if ttl <= 0 or not text:
+        return
+    r = get_redis()
+    if r is None:
+        _local[key] = (text, ttl)
+        return
+    await r.set(f"{_REDIS_KEY_PREFIX}:{key}", text.encode("utf-8"), ex=ttl)
+
+
+def join_inflight_response(key: str) -> asyncio.Future | None:
+    """Future ответа, если такой же вопрос уже обрабатывается; иначе None — вызывающий становится ведущим
+    и обязан вызвать finish_inflight_response (с текстом или None при ошибке)."""
+    future = _inflight.get(key)
+    if future is not None:
+        return future
+    _inflight[key] = asyncio.get_running_loop().create_future()
+    return None
+
+
+def finish_inflight_response(key: str, text: str | None) -> None:
+    """Передать ответ ведущего ожидающим запросам (None — ответа нет, ожидающие вызывают модель сами)."""
+    future = _inflight.pop(key, None)
+    if future is not None and not future.done():
+        future.set_result(text)
@@ -0,0 +1,47 @@
+"""Ограничения тенанта (длина сообщения в чате, размер промпта, документы RAG, галерея) из tenant.settings.
+Общие для кабинета и чата."""
+from functools import lru_cache
+
+# Значения лимитов по умолчанию (могут быть переопределены в tenant.settings)
+DEFAULT_CHAT_MAX_USER_MESSAGE_CHARS = 500
+DEFAULT_USER_PROMPT_MAX_CHARS = 10000
+DEFAULT_RAG_MAX_DOCUMENTS = 3
+DEFAULT_GALLERY_MAX_GROUPS = 3
+DEFAULT_GALLERY_MAX_IMAGES_PER_GROUP = 3
+
+
+_LIMIT_KEYS = (
+    "chat_max_user_message_chars",
+    "user_prompt_max_chars",
+    "rag_max_documents",
+    "gallery_max_groups",
+    "gallery_max_images_per_group",
+)
+
+
+@lru_cache(maxsize=1024)
+def _limits_from_values(values: tuple) -> dict:
+    """Лимиты по значениям ключей _LIMIT_KEYS (у большинства тенантов — одни и те же, обычно умолчания)."""
+    (
+        chat_max_user_message_chars,
+        user_prompt_max_chars,
+        rag_max_documents,
+        gallery_max_groups,
+        gallery_max_images_per_group,
+    ) = values
+    return {
+        "chat_max_user_message_chars": int(chat_max_user_message_chars or DEFAULT_CHAT_MAX_USER_MESSAGE_CHARS),
+        "user_prompt_max_chars": int(user_prompt_max_chars or DEFAULT_USER_PROMPT_MAX_CHARS),
+        "rag_max_documents": int(rag_max_documents or DEFAULT_RAG_MAX_DOCUMENTS),
+        "gallery_max_groups": int(gallery_max_groups or DEFAULT_GALLERY_MAX_GROUPS),
+        "gallery_max_images_per_group": int(
+            gallery_max_images_per_group or DEFAULT_GALLERY_MAX_IMAGES_PER_GROUP
+        ),
+    }
+
+
+def get_limits_from_settings(settings: dict | None) -> dict:
+    """Возвращает словарь лимитов с подстановкой значений по умолчанию.
+    Разбор кэшируется по значениям лимитов; вызывающий получает копию и может её менять."""
+    s = settings or {}
+    return dict(_limits_from_values(tuple(s.get(k) for k in _LIMIT_KEYS)))
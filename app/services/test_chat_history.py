@@ -1,24 +1,82 @@
-"""Хранение истории тестового чата в памяти. Очищается при обновлении тестового промпта."""
-from typing import Dict, List, Tuple
+"""Хранение истории тестового чата. Очищается при обновлении тестового промпта.
+
+Если задан REDIS_URL — история хранится в Redis (список на пару тенант/пользователь, общий для всех воркеров
+и переживающий их перезапуск). Иначе — в памяти процесса: при нескольких воркерах uvicorn у каждого своя копия;
+хранилище ограничено по объёму (LRU по оценке памяти) и по времени жизни записи, чтобы не расти бесконечно.
+"""
+from typing import List, Sequence, Tuple
 from uuid import UUID
 
+import orjson
+from cachetools import TTLCache
+
+from app.config import settings
+from app.services.redis_client import get_redis
+
 _TEST_HISTORY_LIMIT = 10
-_storage: Dict[Tuple[UUID, str], List[dict]] = {}
+_TEST_HISTORY_TTL_SECONDS = 3600
+# Примерные накладные расходы на одно сообщение (dict, ключи) сверх длины текста
+_MESSAGE_OVERHEAD_BYTES = 200
+_REDIS_KEY_PREFIX = "test_hist"
+
+
+def _history_size(history: List[dict]) -> int:
+    """Оценка памяти под историю сессии: длина текстов + накладные расходы на сообщение."""
+    return sum(len(m.get("content") or "") + _MESSAGE_OVERHEAD_BYTES for m in history)
+
 
+# Размер хранилища считается в байтах (getsizeof): при превышении settings.test_history_max_bytes
+# вытесняются самые давно использованные сессии; сессия без активности забывается через час.
+# Операции синхронные (без await), поэтому в asyncio дополнительная блокировка не нужна.
+_storage: TTLCache[Tuple[UUID, str], List[dict]] = TTLCache(
+    maxsize=settings.test_history_max_bytes,
+    ttl=_TEST_HISTORY_TTL_SECONDS,
+    getsizeof=_history_size,
+)
 
-def get_test_history(tenant_id: UUID, user_id: str) -> List[dict]:
-    return list(_storage.get((tenant_id, user_id)) or [])
 
+def _redis_key(tenant_id: UUID, user_id: str) -> str:
+    return f"{_REDIS_KEY_PREFIX}:{tenant_id}:{user_id}"
 
-def save_test_history(tenant_id: UUID, user_id: str, history: List[dict]) -> None:
-    if not history:
-        _storage.pop((tenant_id, user_id), None)
+
+async def get_test_history(tenant_id: UUID, user_id: str) -> Sequence[dict]:
+    """История сессии только для чтения: из памяти отдаётся сам сохранённый список, без копии."""
+    r = get_redis()
+    if r is None:
+        return _storage.get((tenant_id, user_id)) or ()
+    raw = await r.lrange(_redis_key(tenant_id, user_id), -_TEST_HISTORY_LIMIT, -1)
+    return [orjson.loads(item) for item in raw]
+
+
+async def append_test_history(tenant_id: UUID, user_id: str, messages: List[dict]) -> None:
+    """Дописать сообщения в историю сессии; хранятся только последние _TEST_HISTORY_LIMIT."""
+    if not messages:
         return
-    _storage[(tenant_id, user_id)] = history[-_TEST_HISTORY_LIMIT:]
+    r = get_redis()
+    if r is None:
+        prev = _storage.get((tenant_id, user_id)) or []
+        try:
+            _storage[(tenant_id, user_id)] = (prev + messages)[-_TEST_HISTORY_LIMIT:]
+        except ValueError:
+            # История одной сессии больше всего хранилища (TTLCache не принимает такое значение): не храним её
+            _storage.pop((tenant_id, user_id), None)
+        return
+    key = _redis_key(tenant_id, user_id)
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.rpush(key, *(orjson.dumps(m) for m in messages))
+        pipe.ltrim(key, -_TEST_HISTORY_LIMIT, -1)
+        pipe.expire(key, _TEST_HISTORY_TTL_SECONDS)
+        await pipe.execute()
 
 
-def clear_tenant_test_history(tenant_id: UUID) -> None:
+async def clear_tenant_test_history(tenant_id: UUID) -> None:
     """Очистить историю тестового чата для всех пользователей тенанта. Вызывать после сохранения тестового промпта."""
-    keys_to_remove = [k for k in _storage if k[0] == tenant_id]
-    for k in keys_to_remove:
-        del _storage[k]
+    r = get_redis()
+    if r is None:
+        keys_to_remove = [k for k in _storage if k[0] == tenant_id]
+        for k in keys_to_remove:
+            _storage.pop(k, None)
+        return
+    keys = [k async for k in r.scan_iter(match=f"{_REDIS_KEY_PREFIX}:{tenant_id}:*", count=500)]
+    if keys:
+        await r.delete(*keys)
@@ -2,14 +2,17 @@
 Пользовательский чат с MCP: встроенные tools Gallery и RAG (tenant_id подставляется на бэкенде)
 и динамические серверы из БД; цикл до финального ответа.
 """
+import asyncio
 import json
 import re
+from collections.abc import AsyncIterator
+from functools import lru_cache
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.llm_client import chat_once_with_tools
+from app.llm_client import stream_chat_with_tools
 from app.services.mcp_client import (
     GALLERY_TOOL_NAMES,
     RAG_TOOL_NAMES,
@@ -20,24 +23,42 @@ from app.services.mcp_client import (
     get_gallery_tools_for_llm,
     get_rag_tools_for_llm,
 )
-from app.services.cabinet_service import list_mcp_servers, get_mcp_server
+from app.services.cabinet_service import list_mcp_servers
 from app.services.llm_exchange_logger import append_exchange
 
 MAX_TOOL_ROUNDS = 3
 # Сколько последних сообщений диалога передавать в модель (контекстное окно)
 CONTEXT_MESSAGE_LIMIT = 10
+# Окно истории сдвигается шагами по CONTEXT_TRIM_STEP сообщений, а не на каждом ходе: начало запроса
+# (системный промпт, tools, первые сообщения окна) несколько ходов подряд совпадает байт в байт,
+# и DeepSeek отдаёт его из своего кэша префиксов (дешевле и быстрее prefill)
+CONTEXT_TRIM_STEP = 4
+
+
+_LAST_SPACE_RE = re.compile(r"\s(?=\S*$)")
+
+
+def _split_stream_text(text: str) -> tuple[str, str]:
+    """Делит накопленный текст стрима: (до последнего пробельного символа включительно, хвост без пробелов)."""
+    m = _LAST_SPACE_RE.search(text)
+    if not m:
+        return "", text
+    return text[:m.end()], text[m.end():]
+
+
+# Пути от show_gallery: /api/v1/tenants/{tid}/me/gallery/groups/.../file
+_GALLERY_PATH_RE = re.compile(r"(?<![\"'])(/api/v1/tenants/[^/]+/me/gallery/[^\s\"']+)")
 
 
 def _inject_base_url_to_image_paths(text: str, tenant_id: UUID) -> str:
-    """Подставляет frontend_base_url в пути вида /api/v1/tenants/.../me/gallery/..."""
+    """Подставляет frontend_base_url в пути вида /api/v1/tenants/.../me/gallery/...
+    Вызывается на каждый фрагмент стрима: без путей в тексте регулярное выражение не запускается."""
+    if "/me/gallery/" not in text:
+        return text
     base = (settings.frontend_base_url or "").rstrip("/")
     if not base:
         return text
-    # Пути от show_gallery: /api/v1/tenants/{tid}/me/gallery/groups/.../file
-    pattern = r"(?<![\"'])(/api/v1/tenants/[^/]+/me/gallery/[^\s\"']+)"
-    def repl(m: re.Match) -> str:
-        return base + m.group(1)
-    return re.sub(pattern, repl, text)
+    return _GALLERY_PATH_RE.sub(lambda m: base + m.group(1), text)
 
 
 # Блок, добавляемый к системному промпту: контекст тенанта, инструменты, изображения
@@ -48,6 +69,9 @@ _CONTEXT_TENANT_BLOCK = """
 Изображения из галереи: инструмент show_gallery возвращает список URL-путей изображений (каждая строка — один путь вида /api/v1/tenants/.../me/gallery/.../file). Формат отображения ссылок на изображения задаётся в системном промпте.
 """
 
+# Ответ, когда модель исчерпала раунды вызова инструментов и не дала текста
+TOOL_LIMIT_REPLY = "Достигнут лимит вызовов инструментов."
+
 # Контекст для запросов из Telegram-бота (добавляется в системный промпт)
 _TELEGRAM_CONTEXT = "\n\nОбрати внимание! Этот запрос от телеграм бота."
 
@@ -98,29 +122,53 @@ def _build_request_to_llm_text(prompt: str, messages: list[dict]) -> str:
     return "".join(parts)
 
 
-async def _get_all_tools_for_llm(tenant_id: UUID, db: AsyncSession) -> list[dict]:
-    """Встроенные tools Gallery и RAG + включённые MCP-серверы из БД (префикс mcp_<id>__)."""
+def context_window_start(total: int) -> int:
+    """Индекс первого сообщения окна в истории из total сообщений: окно не больше CONTEXT_MESSAGE_LIMIT,
+    начало кратно CONTEXT_TRIM_STEP (0 — история целиком)."""
+    excess = total - CONTEXT_MESSAGE_LIMIT
+    if excess <= 0:
+        return 0
+    return -(-excess // CONTEXT_TRIM_STEP) * CONTEXT_TRIM_STEP
+
+
+def _context_window(messages: list[dict]) -> list[dict]:
+    """Последние сообщения для модели (см. context_window_start)."""
+    return list(messages[context_window_start(len(messages)):])
+
+
+async def _load_enabled_mcp_servers(db: AsyncSession, tenant_id: UUID) -> dict[UUID, tuple[str, str]]:
+    """Включённые MCP-серверы тенанта: id -> (name, base_url). Единственное обращение к БД в цикле чата."""
+    servers = await list_mcp_servers(db, tenant_id)
+    return {s.id: (s.name, s.base_url) for s in servers if s.enabled}
+
+
+async def _get_all_tools_for_llm(servers: dict[UUID, tuple[str, str]]) -> list[dict]:
+    """Встроенные tools Gallery и RAG + включённые MCP-серверы (префикс mcp_<id>__)."""
     out = []
     out.extend(get_gallery_tools_for_llm())
     out.extend(get_rag_tools_for_llm())
-    servers = await list_mcp_servers(db, tenant_id)
-    for s in servers:
-        if not s.enabled:
+    # Списки tools запрашиваем у всех серверов параллельно: задержка — самый медленный сервер, а не сумма
+    fetched = await asyncio.gather(
+        *(fetch_tools_from_url(base_url) for _, base_url in servers.values()),
+        return_exceptions=True,
+    )
+    for (server_id, (server_name, _)), raw in zip(servers.items(), fetched):
+        if isinstance(raw, BaseException):
             continue
         try:
-            raw = await fetch_tools_from_url(s.base_url)
-            for t in raw:
+            # Порядок tools фиксирован (по имени) — часть стабильного префикса запроса к модели
+            for t in sorted(raw, key=lambda t: t.get("name") or ""):
                 name = t.get("name", "")
                 if not name:
                     continue
-                prefixed = f"mcp_{s.id}__{name}"
+                prefixed = f"mcp_{server_id}__{name}"
                 desc = (t.get("description") or "").strip()
                 schema = dict(t.get("inputSchema") or {})
                 out.append({
                     "type": "function",
                     "function": {
                         "name": prefixed,
-                        "description": desc or f"Инструмент {name} (сервер {s.name})",
+                        "description": desc or f"Инструмент {name} (сервер {server_name})",
                         "parameters": schema,
                     },
                 })
@@ -129,30 +177,41 @@ async def _get_all_tools_for_llm(tenant_id: UUID, db: AsyncSession) -> list[dict
     return out
 
 
-async def _call_tool(tenant_id: UUID, name: str, arguments: dict, db: AsyncSession) -> str:
+@lru_cache(maxsize=1024)
+def _parse_mcp_tool_name(name: str) -> tuple[UUID, str] | None:
+    """«mcp_<server_id>__<tool>» -> (server_id, tool); None, если id сервера не UUID.
+    Имена инструментов стабильны (одни и те же в каждом раунде), поэтому разбор кэшируется."""
+    prefix, inner_name = name.split("__", 1)
+    try:
+        return UUID(prefix.replace("mcp_", "")), inner_name
+    except ValueError:
+        return None
+
+
+async def _call_tool(
+    tenant_id: UUID, name: str, arguments: dict, servers: dict[UUID, tuple[str, str]]
+) -> str:
     """Маршрутизация: встроенные Gallery/RAG (tenant_id подставляется) или MCP из БД (mcp_<id>__)."""
     if name in GALLERY_TOOL_NAMES:
         return await call_gallery_tool(tenant_id, name, arguments)
     if name in RAG_TOOL_NAMES:
         return await call_rag_tool(tenant_id, name, arguments)
     if name.startswith("mcp_") and "__" in name:
-        prefix, inner_name = name.split("__", 1)
-        server_id_str = prefix.replace("mcp_", "")
-        try:
-            server_uuid = UUID(server_id_str)
-        except ValueError:
+        target = _parse_mcp_tool_name(name)
+        if target is None:
             return f"Ошибка: неверный идентификатор сервера в имени инструмента."
-        server = await get_mcp_server(db, tenant_id, server_uuid)
+        server_uuid, inner_name = target
+        server = servers.get(server_uuid)
         if not server:
             return f"Ошибка: MCP сервер не найден."
         try:
-            return await call_mcp_tool_by_url(server.base_url, inner_name, arguments)
+            return await call_mcp_tool_by_url(server[1], inner_name, arguments)
         except Exception as e:
             return f"Ошибка вызова инструмента: {e}"
     return f"Неизвестный инструмент: {name}."
 
 
-async def run_user_chat_with_mcp_tools(
+async def run_user_chat_with_mcp_tools_stream(
     tenant_id: UUID,
     system_prompt: str,
     messages: list[dict],
@@ -162,15 +221,19 @@ async def run_user_chat_with_mcp_tools(
     is_admin: bool = False,
     is_test: bool = False,
     session_id: str | None = None,
-) -> str:
+) -> AsyncIterator[str]:
     """
     Запускает диалог с моделью, передаёт tools только из MCP-серверов, добавленных в БД.
-    При tool_calls выполняет вызовы через MCP и повторяет запрос (до 3 раундов).
-    Возвращает финальный текст ответа (без tool_calls).
+    Текст ответа отдаётся по мере генерации модели (stream), пока в раунде не начался вызов инструмента;
+    при tool_calls выполняет вызовы через MCP и повторяет запрос (до 3 раундов).
     Логирование: prodchat (iframe) и telegramchat (Telegram) — всегда; testchat — только при is_admin.
     При from_telegram в промпт добавляется контекст про Telegram.
     """
-    tools = await _get_all_tools_for_llm(tenant_id, db)
+    servers = await _load_enabled_mcp_servers(db, tenant_id)
+    # Дальше БД не нужна до сохранения ответа: завершаем транзакцию, чтобы соединение вернулось в пул
+    # на время вызовов MCP и модели (секунды), а не удерживалось всю длительность запроса
+    await db.commit()
+    tools = await _get_all_tools_for_llm(servers)
     prompt_with_context = (system_prompt or "").strip() + _CONTEXT_TENANT_BLOCK + _FORMAT_RULE
     if from_telegram:
         prompt_with_context += _TELEGRAM_CONTEXT
@@ -185,33 +248,38 @@ async def run_user_chat_with_mcp_tools(
     # prodchat и telegramchat логируем всегда; testchat — только для админа
     should_log = (chat_type in ("prodchat", "telegramchat")) or is_admin
 
-    if not tools:
-        from app.llm_client import chat_once
-        current_messages = list(messages)[-CONTEXT_MESSAGE_LIMIT:]
-        messages_for_llm = _sanitize_messages_for_llm(current_messages)
-        request_text = _build_request_to_llm_text(prompt_with_context, messages_for_llm)
-        result = await chat_once(prompt_with_context, messages_for_llm)
-        if should_log:
-            append_exchange(
-                chat_type,
-                tenant_id,
-                log_session_id,
-                request_text,
-                result or "",
-                is_new_session=True,
-                is_admin=is_admin,
-            )
-        return result or ""
-
     # Контекстное окно: только последние N сообщений; блоки [HTML] в истории санитизируются — в модель не передаются
-    current_messages = list(messages)[-CONTEXT_MESSAGE_LIMIT:]
+    current_messages = _context_window(messages)
     round_index = 0
+    content = raw_content = ""
+    sent_len = 0
     for _ in range(MAX_TOOL_ROUNDS):
         messages_for_llm = _sanitize_messages_for_llm(current_messages)
         request_text = _build_request_to_llm_text(prompt_with_context, messages_for_llm)
-        out = await chat_once_with_tools(prompt_with_context, messages_for_llm, tools)
-        content = out.get("content") or ""
-        tool_calls = out.get("tool_calls")
+        content_parts = []
+        tool_calls = None
+        tool_calls_started = False
+        # Текст отдаём сразу, пока модель не начала вызов инструмента (после него текст раунда — не ответ
+        # пользователю). Хвост после последнего пробела придерживаем: в нём может быть недописанный путь
+        # к изображению, к которому подставляется frontend_base_url
+        pending = ""
+        sent_len = 0
+        async for event in stream_chat_with_tools(prompt_with_context, messages_for_llm, tools):
+            if "tool_calls" in event:
+                tool_calls = event["tool_calls"]
+                continue
+            if "tool_calls_started" in event:
+                tool_calls_started = True
+                continue
+            content_parts.append(event["content"])
+            if tool_calls_started:
+                continue
+            ready, pending = _split_stream_text(pending + event["content"])
+            if ready:
+                sent_len += len(ready)
+                yield _inject_base_url_to_image_paths(ready, tenant_id)
+        raw_content = "".join(content_parts)
+        content = raw_content.strip()
         response_for_log = content
         if tool_calls:
             response_for_log += "\n[tool_calls]\n" + "\n".join(
@@ -230,7 +298,9 @@ async def run_user_chat_with_mcp_tools(
         round_index += 1
 
         if not tool_calls:
-            return _inject_base_url_to_image_paths(content, tenant_id)
+            if pending:
+                yield _inject_base_url_to_image_paths(pending, tenant_id)
+            return
 
         # Формат assistant message с tool_calls для следующего запроса
         assistant_msg = {
@@ -255,7 +325,7 @@ async def run_user_chat_with_mcp_tools(
             name = tc.get("name") or ""
             arguments = tc.get("arguments") or {}
             try:
-                result = await _call_tool(tenant_id, name, arguments, db)
+                result = await _call_tool(tenant_id, name, arguments, servers)
             except Exception as e:
                 result = f"Ошибка: {e}"
             current_messages.append({
@@ -264,4 +334,8 @@ async def run_user_chat_with_mcp_tools(
                 "content": result,
             })
 
-    return content or "Достигнут лимит вызовов инструментов."
+    # Лимит раундов: ответ — текст последнего раунда (его неотданная часть) или TOOL_LIMIT_REPLY
+    if not content:
+        yield TOOL_LIMIT_REPLY
+    elif raw_content[sent_len:].strip():
+        yield _inject_base_url_to_image_paths(raw_content[sent_len:], tenant_id)
@@ -12,12 +12,12 @@ import httpx
 
 from app.config import settings
 
-EXECUTE_BLOCK_RE = re.compile(r"\[EXECUTE\](.*?)\[/EXECUTE\]", re.DOTALL | re.IGNORECASE)
+EXECUTE_BLOCK_RE = re.compile(r"\[EXECUTE\](.*?)\[/EXECUTE\]", re.DOTALL | re.IGNORECASE | re.ASCII)
 
 
 def _parse_block(block_content: str) -> tuple[str, dict[str, str]]:
     """Первая строка — команда, остальные — key=value. Возвращает (command_upper, {key: value})."""
-    lines = [s.strip() for s in block_content.strip().split("\n") if s.strip()]
+    lines = [ln for s in block_content.splitlines() if (ln := s.strip())]
     if not lines:
         return "", {}
     cmd = lines[0].upper()
@@ -159,6 +159,8 @@ async def run_user_command(tenant_id: UUID, block_content: str) -> str:
 
 def strip_execute_blocks(text: str) -> str:
     """Удаляет блоки [EXECUTE]...[/EXECUTE] из текста."""
+    if "[" not in text:
+        return text.strip()
     return EXECUTE_BLOCK_RE.sub("", text).strip()
 
 
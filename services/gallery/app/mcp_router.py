@@ -143,18 +143,19 @@ async def _run_tool(db: AsyncSession, name: str, arguments: dict) -> str:
         group = r.scalar_one_or_none()
         if not group:
             return "Галерея не найдена."
+        # Нужны только id изображений — бинарные данные не загружаются
         r2 = await db.execute(
-            select(GalleryImage)
+            select(GalleryImage.id)
             .where(GalleryImage.group_id == group_uuid)
             .order_by(GalleryImage.created_at)
         )
-        images = list(r2.scalars().all())
-        if not images:
+        image_ids = list(r2.scalars().all())
+        if not image_ids:
             return f"Галерея «{group.name}» пуста."
         # URL для получения файла через основное приложение (клиент подставит base)
         paths = [
-            f"/api/v1/tenants/{tid}/me/gallery/groups/{gid}/images/{img.id}/file"
-            for img in images
+            f"/api/v1/tenants/{tid}/me/gallery/groups/{gid}/images/{image_id}/file"
+            for image_id in image_ids
         ]
         return f"Галерея «{group.name}»:\n" + "\n".join(paths)
 
@@ -7,7 +7,7 @@ from uuid import UUID
 
 from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from fastapi.responses import Response
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database import get_db
@@ -30,26 +30,25 @@ async def list_groups(
     tenant_id: UUID = Query(..., description="ID тенанта"),
     db: AsyncSession = Depends(get_db),
 ):
+    # Число изображений — одним запросом (LEFT JOIN + GROUP BY), без запроса и загрузки изображений на каждую группу
     r = await db.execute(
-        select(GalleryGroup)
+        select(GalleryGroup, func.count(GalleryImage.id))
+        .outerjoin(GalleryImage, GalleryImage.group_id == GalleryGroup.id)
         .where(GalleryGroup.tenant_id == tenant_id)
+        .group_by(GalleryGroup.id)
         .order_by(GalleryGroup.created_at.desc())
     )
-    groups = list(r.scalars().all())
-    out = []
-    for g in groups:
-        cnt = await db.execute(select(GalleryImage).where(GalleryImage.group_id == g.id))
-        out.append(
-            GroupResponse(
-                id=g.id,
-                tenant_id=g.tenant_id,
-                name=g.name,
-                description=g.description,
-                created_at=g.created_at,
-                image_count=len(cnt.scalars().all()),
-            )
+    return [
+        GroupResponse(
+            id=g.id,
+            tenant_id=g.tenant_id,
+            name=g.name,
+            description=g.description,
+            created_at=g.created_at,
+            image_count=image_count,
         )
-    return out
+        for g, image_count in r.all()
+    ]
 
 
 @router.get("/groups/{group_id}", response_model=GroupWithImagesResponse)
@@ -58,12 +57,13 @@ async def get_group(group_id: UUID, db: AsyncSession = Depends(get_db)):
     group = r.scalar_one_or_none()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
+    # Только метаданные: бинарные данные изображений для списка не нужны
     r2 = await db.execute(
-        select(GalleryImage)
+        select(GalleryImage.id, GalleryImage.group_id, GalleryImage.created_at)
         .where(GalleryImage.group_id == group_id)
         .order_by(GalleryImage.created_at)
     )
-    images = list(r2.scalars().all())
+    images = r2.all()
     # url — путь для получения файла (основное приложение подставит свой base)
     image_responses = [
         ImageResponse(
@@ -117,14 +117,16 @@ async def update_group(
     if body.description is not None:
         group.description = body.description.strip() or None
     await db.flush()
-    cnt = await db.execute(select(GalleryImage).where(GalleryImage.group_id == group.id))
+    image_count = await db.scalar(
+        select(func.count()).select_from(GalleryImage).where(GalleryImage.group_id == group.id)
+    )
     return GroupResponse(
         id=group.id,
         tenant_id=group.tenant_id,
         name=group.name,
         description=group.description,
         created_at=group.created_at,
-        image_count=len(cnt.scalars().all()),
+        image_count=image_count or 0,
     )
 
 
@@ -0,0 +1,35 @@
+"""Tests for cabinet service: profile upsert."""
+import pytest
+from sqlalchemy import select
+
+from app.models import Tenant
+from app.services.cabinet_service import get_profile, upsert_profile
+
+
+@pytest.mark.asyncio
+async def test_upsert_profile_inserts_new_profile(db_session):
+    """upsert_profile creates the profile when it does not exist yet."""
+    tenant = (await db_session.execute(select(Tenant).where(Tenant.slug == "test"))).scalar_one()
+    profile = await upsert_profile(db_session, tenant.id, "user1", display_name="Ivan")
+    await db_session.commit()
+    assert profile.user_id == "user1"
+    assert profile.display_name == "Ivan"
+    assert profile.contact is None
+    stored = await get_profile(db_session, tenant.id, "user1")
+    assert stored is not None
+    assert stored.display_name == "Ivan"
+
+
+@pytest.mark.asyncio
+async def test_upsert_profile_updates_only_given_fields(db_session):
+    """upsert_profile on an existing profile updates the given fields and keeps the others."""
+    tenant = (await db_session.execute(select(Tenant).where(Tenant.slug == "test"))).scalar_one()
+    await upsert_profile(db_session, tenant.id, "user1", display_name="Ivan", contact="old@example.com")
+    await db_session.commit()
+    profile = await upsert_profile(db_session, tenant.id, "user1", contact="new@example.com")
+    await db_session.commit()
+    assert profile.display_name == "Ivan"
+    assert profile.contact == "new@example.com"
+    stored = await get_profile(db_session, tenant.id, "user1")
+    assert stored.display_name == "Ivan"
+    assert stored.contact == "new@example.com"
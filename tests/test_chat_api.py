@@ -1,4 +1,5 @@
 """Tests for chat API: POST message, SSE (mocked LLM)."""
+import asyncio
 import json
 from unittest.mock import AsyncMock, patch
 
@@ -39,3 +40,63 @@ async def test_chat_post_returns_sse_with_mocked_llm(async_client, db_session):
     text = r.text
     assert "Hello" in text
     assert "world" in text
+
+
+@pytest.mark.asyncio
+async def test_keepalive_interleaves_pings_while_stream_is_silent():
+    """_with_keepalive sends a ping when the next frame takes longer than the ping interval."""
+    from app.routers.chat import _SSE_PING, _with_keepalive
+
+    async def frames():
+        yield b"first"
+        await asyncio.sleep(0.2)
+        yield b"second"
+
+    with patch("app.routers.chat._SSE_PING_INTERVAL_SECONDS", 0.05):
+        out = [frame async for frame in _with_keepalive(frames())]
+    assert out[0] == b"first"
+    assert out[-1] == b"second"
+    assert _SSE_PING in out[1:-1]
+
+
+@pytest.mark.asyncio
+async def test_keepalive_cancels_inner_stream_on_disconnect():
+    """Closing the keepalive stream (client disconnect) cancels the pending read of the inner stream."""
+    from app.routers.chat import _SSE_PING, _with_keepalive
+
+    inner_closed = asyncio.Event()
+
+    async def frames():
+        try:
+            yield b"first"
+            await asyncio.sleep(60)
+            yield b"never"
+        finally:
+            inner_closed.set()
+
+    with patch("app.routers.chat._SSE_PING_INTERVAL_SECONDS", 0.05):
+        stream = _with_keepalive(frames())
+        assert await stream.__anext__() == b"first"
+        assert await stream.__anext__() == _SSE_PING
+        await stream.aclose()
+    assert inner_closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_keepalive_closes_inner_stream_between_frames():
+    """Closing the keepalive stream right after a frame also closes the inner stream."""
+    from app.routers.chat import _with_keepalive
+
+    inner_closed = asyncio.Event()
+
+    async def frames():
+        try:
+            yield b"first"
+            yield b"second"
+        finally:
+            inner_closed.set()
+
+    stream = _with_keepalive(frames())
+    assert await stream.__anext__() == b"first"
+    await stream.aclose()
+    assert inner_closed.is_set()
@@ -0,0 +1,107 @@
+"""Tests for the first-message response cache and in-flight coalescing (mocked LLM and DB)."""
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from uuid import uuid4
+
+import pytest
+
+from app.routers.chat import _get_chat_reply
+from app.services.cabinet_service import TenantInfo
+from app.services.response_cache import _inflight
+
+
+@pytest.fixture
+def chat_db():
+    """Chat router DB calls replaced with mocks: each user gets a new empty dialog."""
+    with (
+        patch("app.routers.chat.get_or_create_dialog", new=AsyncMock(side_effect=lambda *a: SimpleNamespace(id=uuid4()))),
+        patch("app.routers.chat.get_dialog_tail_for_llm", new=AsyncMock(return_value=([], 0))),
+        patch("app.routers.chat.save_messages_bulk", new=AsyncMock()),
+        patch("app.routers.chat._save_messages_bg", new=AsyncMock()),
+        patch("app.services.response_cache.get_redis", return_value=None),
+    ):
+        yield AsyncMock()
+
+
+def _tenant() -> TenantInfo:
+    return TenantInfo(id=uuid4(), slug="cache", name="Cache", settings={"response_cache_ttl_seconds": 60})
+
+
+async def _reply(tenant: TenantInfo, user_id: str, db) -> str:
+    return await _get_chat_reply(tenant.id, user_id, None, "Hello", db, prompt="You are a helper", tenant=tenant)
+
+
+@pytest.mark.asyncio
+async def test_repeated_first_message_served_from_cache(chat_db):
+    """The second identical first message is answered from the cache without calling the LLM."""
+    tenant = _tenant()
+    calls = 0
+
+    async def llm(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        yield "Hi there"
+
+    with patch("app.routers.chat.run_user_chat_with_mcp_tools_stream", new=llm):
+        first = await _reply(tenant, "u1", chat_db)
+        second = await _reply(tenant, "u2", chat_db)
+    assert first == second == "Hi there"
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_messages_share_one_llm_call(chat_db):
+    """An identical question arriving while the first is generated waits for it instead of calling the LLM."""
+    tenant = _tenant()
+    calls = 0
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def llm(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        yield "Shared answer"
+
+    with patch("app.routers.chat.run_user_chat_with_mcp_tools_stream", new=llm):
+        leader = asyncio.create_task(_reply(tenant, "u1", chat_db))
+        await started.wait()
+        follower = asyncio.create_task(_reply(tenant, "u2", chat_db))
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.wait_for(asyncio.gather(leader, follower), timeout=5)
+    assert results == ["Shared answer", "Shared answer"]
+    assert calls == 1
+    assert not _inflight
+
+
+@pytest.mark.asyncio
+async def test_leader_failure_does_not_hang_followers(chat_db):
+    """When the leading request fails, a waiting request calls the LLM itself instead of hanging."""
+    tenant = _tenant()
+    calls = 0
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def llm(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            started.set()
+            await release.wait()
+            raise RuntimeError("LLM unavailable")
+        yield "Fallback answer"
+
+    with patch("app.routers.chat.run_user_chat_with_mcp_tools_stream", new=llm):
+        leader = asyncio.create_task(_reply(tenant, "u1", chat_db))
+        await started.wait()
+        follower = asyncio.create_task(_reply(tenant, "u2", chat_db))
+        await asyncio.sleep(0.05)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(leader, timeout=5)
+        assert await asyncio.wait_for(follower, timeout=5) == "Fallback answer"
+    assert calls == 2
+    assert not _inflight
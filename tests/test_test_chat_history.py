@@ -0,0 +1,134 @@
+"""Tests for test chat history: in-memory (byte-size bound) and Redis backends."""
+import fnmatch
+from uuid import uuid4
+
+import pytest
+from cachetools import TTLCache
+
+from app.services import test_chat_history as history_module
+from app.services.test_chat_history import append_test_history, clear_tenant_test_history, get_test_history
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._ops = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def rpush(self, key, *values):
+        self._ops.append(lambda: self._redis.lists.setdefault(key, []).extend(values))
+
+    def ltrim(self, key, start, end):
+        self._ops.append(lambda: self._redis.lists.__setitem__(key, self._redis.slice(key, start, end)))
+
+    def expire(self, key, seconds):
+        self._ops.append(lambda: self._redis.expiry.__setitem__(key, seconds))
+
+    async def execute(self):
+        for op in self._ops:
+            op()
+
+
+class _FakeRedis:
+    """Minimal in-process stand-in for the Redis list commands used by test_chat_history."""
+
+    def __init__(self):
+        self.lists: dict[str, list[bytes]] = {}
+        self.expiry: dict[str, int] = {}
+
+    def slice(self, key, start, end):
+        items = self.lists.get(key, [])
+        n = len(items)
+        start = max(n + start, 0) if start < 0 else start
+        end = n + end if end < 0 else end
+        return items[start : end + 1]
+
+    async def lrange(self, key, start, end):
+        return self.slice(key, start, end)
+
+    def pipeline(self, transaction=True):
+        return _FakePipeline(self)
+
+    async def scan_iter(self, match, count=None):
+        for key in list(self.lists):
+            if fnmatch.fnmatchcase(key, match):
+                yield key
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.lists.pop(key, None)
+            self.expiry.pop(key, None)
+
+
+def _messages(count: int, size: int = 10) -> list[dict]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:0{size}d}"} for i in range(count)]
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    monkeypatch.setattr(history_module, "get_redis", lambda: None)
+
+
+@pytest.fixture
+def redis_backend(monkeypatch):
+    fake = _FakeRedis()
+    monkeypatch.setattr(history_module, "get_redis", lambda: fake)
+    return fake
+
+
+@pytest.mark.asyncio
+async def test_memory_history_keeps_last_messages(memory_backend):
+    """In-memory history keeps only the last _TEST_HISTORY_LIMIT messages, in order."""
+    tenant_id = uuid4()
+    messages = _messages(12)
+    await append_test_history(tenant_id, "u1", messages[:6])
+    await append_test_history(tenant_id, "u1", messages[6:])
+    assert list(await get_test_history(tenant_id, "u1")) == messages[-history_module._TEST_HISTORY_LIMIT:]
+    await clear_tenant_test_history(tenant_id)
+    assert not await get_test_history(tenant_id, "u1")
+
+
+@pytest.mark.asyncio
+async def test_memory_history_is_bounded_by_bytes(memory_backend, monkeypatch):
+    """When the byte budget is exceeded, the least recently used sessions are evicted."""
+    storage = TTLCache(maxsize=1000, ttl=3600, getsizeof=history_module._history_size)
+    monkeypatch.setattr(history_module, "_storage", storage)
+    tenant_id = uuid4()
+    # Each session: 300 characters + per-message overhead = 500 "bytes"
+    for user_id in ("u1", "u2", "u3"):
+        await append_test_history(tenant_id, user_id, _messages(1, size=300))
+    assert storage.currsize <= storage.maxsize
+    assert not await get_test_history(tenant_id, "u1")
+    assert len(await get_test_history(tenant_id, "u3")) == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_history_larger_than_budget_is_not_stored(memory_backend, monkeypatch):
+    """A single session larger than the whole budget is dropped instead of raising."""
+    storage = TTLCache(maxsize=1000, ttl=3600, getsizeof=history_module._history_size)
+    monkeypatch.setattr(history_module, "_storage", storage)
+    tenant_id = uuid4()
+    await append_test_history(tenant_id, "u1", _messages(1, size=2000))
+    assert not await get_test_history(tenant_id, "u1")
+
+
+@pytest.mark.asyncio
+async def test_redis_history_keeps_last_messages_with_ttl(redis_backend):
+    """Redis history is a trimmed list per tenant/user with an expiry; clearing removes only that tenant."""
+    tenant_id, other_tenant_id = uuid4(), uuid4()
+    messages = _messages(12)
+    await append_test_history(tenant_id, "u1", messages[:6])
+    await append_test_history(tenant_id, "u1", messages[6:])
+    await append_test_history(other_tenant_id, "u1", messages[:2])
+    assert await get_test_history(tenant_id, "u1") == messages[-history_module._TEST_HISTORY_LIMIT:]
+    key = history_module._redis_key(tenant_id, "u1")
+    assert len(redis_backend.lists[key]) == history_module._TEST_HISTORY_LIMIT
+    assert redis_backend.expiry[key] == history_module._TEST_HISTORY_TTL_SECONDS
+    await clear_tenant_test_history(tenant_id)
+    assert await get_test_history(tenant_id, "u1") == []
+    assert await get_test_history(other_tenant_id, "u1") == messages[:2]